@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Fires many concurrent `gender_bend_async` calls and reports their latency,
+the throughput, and how long the event loop stalled (which should stay close
+to zero, since the work runs in an executor):
+
+    ./benchmarks/async_latency.py --requests 2000 --concurrency 200 --processes 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gender_bender import AsyncGenderBender, warmup  # noqa: E402
+
+SNIPPETS = [
+    'If Ivanka weren\'t my daughter, perhaps I\'d be dating her.',
+    'Simon, walking in front of Ralph, felt a flicker of incredulity',
+    'the boy glanced over his shoulder',
+    'By her own hand was her sword crafted for her',
+    'Attention Ladies and Gentlemen',
+]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+async def measure_loop_lag(stop, lags, interval=0.01):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def run(flipper, num_requests, concurrency):
+    latencies = []
+    lags = []
+    stop = asyncio.Event()
+    lag_task = asyncio.ensure_future(measure_loop_lag(stop, lags))
+    # Only `concurrency` requests are in flight, like clients of a service
+    request_slots = asyncio.Semaphore(concurrency)
+
+    async def request(ii):
+        async with request_slots:
+            start = time.perf_counter()
+            await flipper.gender_bend(SNIPPETS[ii % len(SNIPPETS)])
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[request(ii) for ii in range(num_requests)])
+    duration = time.perf_counter() - start
+    stop.set()
+    await lag_task
+    return {
+        'requests': num_requests,
+        'concurrency': concurrency,
+        'requests_per_s': num_requests / duration,
+        'latency_p50_ms': 1000 * percentile(latencies, 0.5),
+        'latency_p90_ms': 1000 * percentile(latencies, 0.9),
+        'latency_p99_ms': 1000 * percentile(latencies, 0.99),
+        'max_loop_lag_ms': 1000 * max(lags, default=0),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--max-pending', type=int, default=64,
+                        help='Bound on the calls running or queued in the executor')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='Use a pool of this many processes instead of threads')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--engine', default='word')
+    parser.add_argument('--output', type=str, help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    warmup(args.engine)
+    flipper = AsyncGenderBender(
+        max_workers=args.processes or args.threads, use_processes=bool(args.processes),
+        max_pending=args.max_pending, engine=args.engine,
+    )
+    loop = asyncio.new_event_loop()
+    # A first call starts the executor (and loads the models in each process)
+    loop.run_until_complete(run(flipper, args.max_pending, args.max_pending))
+    results = loop.run_until_complete(run(flipper, args.requests, args.concurrency))
+    loop.close()
+    flipper.shutdown()
+
+    for key, value in results.items():
+        print('{:>16}: {:.1f}'.format(key, value))
+    if args.output:
+        with open(args.output, 'w') as fo:
+            json.dump(results, fo, indent=2)
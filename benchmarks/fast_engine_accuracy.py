@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compares the `fast` engine with the spaCy `word` engine on books.
+
+Each document of each epub is flipped with both engines, and the replacements
+they make are compared span by span:
+
+ - `same`: same span, same replacement
+ - `different`: same span, different replacement (e.g. `his` instead of `him`)
+ - `missed`: only replaced by the `word` engine (mostly names spaCy tagged as
+   persons, that aren't in the name lists)
+ - `extra`: only replaced by the `fast` engine
+
+The agreement is `same` over all the spans replaced by either engine:
+
+    ./benchmarks/fast_engine_accuracy.py --examples 5
+"""
+import argparse
+import collections
+import json
+import os
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLES_DIR = os.path.join(REPO_DIR, 'examples')
+REFERENCE_ENGINE = 'word'
+
+
+def find_replacements(flipper, texts):
+    """
+    :return: `(replacements, seconds)`, the replacements being a list of dicts
+        of `(start, end)` to replacement, one per text
+    """
+    from gender_bender import NamingSession
+
+    session = NamingSession()
+    replacements = []
+    start = time.perf_counter()
+    for text in texts:
+        replacements.append({(term_start, term_end): replacement
+                             for term_start, term_end, replacement
+                             in flipper._find_replacements(text, session)})
+    return replacements, time.perf_counter() - start
+
+
+def compare_book(path, num_examples=0):
+    """
+    :return: dict of the counts of each kind of difference, the throughput of
+        both engines, and up to `num_examples` examples of differences
+    """
+    from gender_bender.epub import iter_documents
+    from gender_bender.gender_tools import _get_flipper
+
+    texts = [text for _, text in iter_documents(path)]
+    reference, reference_seconds = find_replacements(_get_flipper(REFERENCE_ENGINE), texts)
+    fast, fast_seconds = find_replacements(_get_flipper('fast'), texts)
+
+    counts = collections.Counter(dict.fromkeys(['same', 'different', 'missed', 'extra'], 0))
+    examples = []
+    for text, reference_replacements, fast_replacements in zip(texts, reference, fast):
+        for span in sorted(reference_replacements.keys() | fast_replacements.keys()):
+            reference_replacement = reference_replacements.get(span)
+            fast_replacement = fast_replacements.get(span)
+            if reference_replacement == fast_replacement:
+                counts['same'] += 1
+                continue
+            elif fast_replacement is None:
+                kind = 'missed'
+            elif reference_replacement is None:
+                kind = 'extra'
+            else:
+                kind = 'different'
+            counts[kind] += 1
+            if len(examples) < num_examples:
+                start, end = span
+                examples.append({
+                    'kind': kind,
+                    'context': text[max(start - 40, 0):end + 40].replace('\n', ' '),
+                    'term': text[start:end],
+                    REFERENCE_ENGINE: reference_replacement,
+                    'fast': fast_replacement,
+                })
+
+    num_chars = sum(len(text) for text in texts)
+    total = sum(counts.values())
+    return {
+        'counts': dict(counts),
+        'agreement': counts['same'] / total if total else None,
+        'chars_per_s': {
+            REFERENCE_ENGINE: num_chars / reference_seconds if reference_seconds else None,
+            'fast': num_chars / fast_seconds if fast_seconds else None,
+        },
+        'examples': examples,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--books', nargs='*',
+                        default=sorted(os.path.join(EXAMPLES_DIR, name)
+                                       for name in os.listdir(EXAMPLES_DIR)
+                                       if name.endswith('.epub')),
+                        help='Epubs to compare on (by default, those of `examples/`)')
+    parser.add_argument('--examples', type=int, default=0,
+                        help='Number of differences to show per book')
+    parser.add_argument('--output', type=str, help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    results = {}
+    totals = collections.Counter()
+    for path in args.books:
+        name = os.path.basename(path)
+        result = results[name] = compare_book(path, args.examples)
+        totals.update(result['counts'])
+        print('{:<40} agreement {:>6.1%}  {}  ({:.0f} vs {:.0f} chars/s)'.format(
+            name, result['agreement'] or 0,
+            ' '.join('{}={}'.format(kind, count) for kind, count in result['counts'].items()),
+            result['chars_per_s']['fast'] or 0, result['chars_per_s'][REFERENCE_ENGINE] or 0,
+        ))
+        for example in result['examples']:
+            print('    {kind:<9} {term!r}: {word!r} vs {fast!r}  ...{context}...'.format(
+                **example))
+    total = sum(totals.values())
+    if total:
+        print('Overall agreement: {:.1%}'.format(totals['same'] / total))
+
+    if args.output:
+        with open(args.output, 'w') as fo:
+            json.dump(results, fo, indent=2)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tracks how long `import gender_bender` takes, using `python -X importtime`.
+
+Each run appends a record to a JSON history file, so the import time can be
+followed over time, and fails if it goes over a threshold:
+
+    ./benchmarks/import_time.py --history benchmarks/import_time.json --max-ms 100
+"""
+import argparse
+import datetime
+import json
+import os
+import re
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORTTIME_REGEX = re.compile(r'import time:\s*(\d+) \|\s*(\d+) \|( *)(\S+)')
+
+
+def measure_import_time(module='gender_bender'):
+    """Imports `module` in a fresh interpreter.
+
+    :return: cumulative import time of `module` (in µs), and dict of the
+        modules it imported to their own import time (in µs)
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+        cwd=REPO_DIR, stderr=subprocess.PIPE, universal_newlines=True, check=True,
+    )
+    # `-X importtime` lists a module after all the modules it imported, and
+    # interpreter start-up modules come first
+    self_times = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_REGEX.match(line)
+        if match is None:
+            continue
+        self_time, cumulative, indent, name = match.groups()
+        if len(indent) == 1 and name != module:
+            self_times = {}
+            continue
+        self_times[name] = int(self_time)
+        if name == module:
+            return int(cumulative), self_times
+    raise RuntimeError('No import time found for: {}'.format(module))
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=REPO_DIR, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='gender_bender',
+                        help='Module whose import is timed')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of fresh interpreters to take the best time of')
+    parser.add_argument('--history', type=str,
+                        help='JSON file the result gets appended to')
+    parser.add_argument('--max-ms', type=float,
+                        help='Fail if the import takes longer than this')
+    args = parser.parse_args()
+
+    import_us, self_times = min(
+        (measure_import_time(args.module) for _ in range(args.repeat)),
+        key=lambda run: run[0],
+    )
+    import_ms = import_us / 1000
+    slowest = sorted(self_times.items(), key=lambda item: -item[1])[:10]
+
+    print('import {}: {:.1f} ms, slowest modules:'.format(args.module, import_ms))
+    for name, self_time in slowest:
+        print('  {:>8.1f} ms  {}'.format(self_time / 1000, name))
+
+    if args.history:
+        history = []
+        if os.path.exists(args.history):
+            with open(args.history) as fo:
+                history = json.load(fo)
+        history.append({
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'revision': _git_revision(),
+            'python': sys.version.split()[0],
+            'import_ms': import_ms,
+            'slowest_ms': {name: self_time / 1000 for name, self_time in slowest},
+        })
+        with open(args.history, 'w') as fo:
+            json.dump(history, fo, indent=2)
+
+    if args.max_ms is not None and import_ms > args.max_ms:
+        sys.exit('Import took {:.1f} ms, more than the {} ms allowed'.format(
+            import_ms, args.max_ms))
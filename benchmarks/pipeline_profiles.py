@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Compares the spaCy pipeline profiles (see `gender_bender/pipeline.py`).
+
+For each profile and engine, a synthetic text is flipped in a fresh
+interpreter (see `throughput.py`), reporting the time it takes to load the
+pipeline, the peak RSS and the throughput:
+
+    ./benchmarks/pipeline_profiles.py --size 64000
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gender_bender.pipeline import PIPELINE_PROFILES  # noqa: E402
+from throughput import run_case_in_subprocess  # noqa: E402
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profiles', nargs='+', default=list(PIPELINE_PROFILES),
+                        choices=PIPELINE_PROFILES)
+    parser.add_argument('--engines', nargs='+', default=['word', 'document'])
+    parser.add_argument('--size', type=int, default=64000,
+                        help='Size of the synthetic text, in characters')
+    parser.add_argument('--output', type=str, help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    results = {}
+    for engine in args.engines:
+        for profile in args.profiles:
+            name = '{}/{}'.format(engine, profile)
+            result = results[name] = run_case_in_subprocess(
+                {'kind': 'text', 'engine': engine, 'size': args.size, 'profile': profile})
+            print('{:<24} load {:>6.2f} s {:>8.1f} MB {:>10.0f} chars/s'.format(
+                name, result['stages_s']['load'], result['peak_rss_mb'],
+                result['chars_per_s'] or 0))
+
+    if args.output:
+        with open(args.output, 'w') as fo:
+            json.dump(results, fo, indent=2)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Memory of forked workers, with and without the pre-fork mode (see
+`gender_bender/prefork.py`).
+
+For each mode, a fresh interpreter forks the workers, each one flipping a
+synthetic text (see `throughput.py`), then reports their unique (USS) and
+proportional (PSS) memory.  The total PSS, parent included, is what the
+workers cost the box:
+
+    ./benchmarks/prefork_memory.py --workers 8 --engine word
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gender_bender import gender_bend  # noqa: E402
+from gender_bender.prefork import fork_workers, memory_usage, preload  # noqa: E402
+from throughput import synthetic_text  # noqa: E402
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# `cold`: each worker loads the models itself
+MODES = ('cold', 'prefork-dicts', 'prefork')
+
+
+def run_mode(mode, engine, num_workers, size):
+    if mode != 'cold':
+        preload(engines=(engine,), compact_tables=mode == 'prefork')
+    text = synthetic_text(size)
+    ready_fd, done_fd = os.pipe()
+
+    def work(index):
+        gender_bend(text, engine=engine)
+        os.write(done_fd, b'x')
+        # Stays alive until its memory is measured
+        time.sleep(3600)
+
+    pids = fork_workers(num_workers, work)
+    try:
+        for _ in pids:
+            os.read(ready_fd, 1)
+        workers = [memory_usage(pid) for pid in pids]
+        parent = memory_usage()
+    finally:
+        for pid in pids:
+            os.kill(pid, 9)
+            os.waitpid(pid, 0)
+    mb = 1024 ** 2
+    return {
+        'worker_uss_mb': sum(worker['uss'] for worker in workers) / len(workers) / mb,
+        'worker_pss_mb': sum(worker['pss'] for worker in workers) / len(workers) / mb,
+        'total_pss_mb': (parent['pss'] + sum(worker['pss'] for worker in workers)) / mb,
+    }
+
+
+def run_mode_in_subprocess(mode, engine, num_workers, size):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--mode', mode, '--engine', engine,
+         '--workers', str(num_workers), '--size', str(size)],
+        cwd=REPO_DIR, stdout=subprocess.PIPE, universal_newlines=True, check=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES)
+    parser.add_argument('--engine', default='word')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--size', type=int, default=64000,
+                        help='Size of the synthetic text, in characters')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--output', type=str, help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    if args.mode:
+        # Runs a single mode, in the interpreter started by `run_mode_in_subprocess()`
+        print(json.dumps(run_mode(args.mode, args.engine, args.workers, args.size)))
+        sys.exit()
+
+    if memory_usage() is None:
+        sys.exit('The memory of the processes can only be measured on Linux')
+    results = {}
+    for mode in args.modes:
+        result = results[mode] = run_mode_in_subprocess(mode, args.engine, args.workers,
+                                                        args.size)
+        print('{:<14} USS {:>7.1f} MB  PSS {:>7.1f} MB per worker, {:>7.1f} MB in '
+              'total'.format(mode, result['worker_uss_mb'], result['worker_pss_mb'],
+                             result['total_pss_mb']))
+
+    if args.output:
+        with open(args.output, 'w') as fo:
+            json.dump(results, fo, indent=2)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Load test of the HTTP server (`python -m gender_bender.serve`): fires many
+concurrent `POST /text` requests, and reports their latency percentiles, the
+throughput, and the batches the server gathered them into.
+
+A server is started with the given options, unless `--url` points at one
+that's already running:
+
+    ./benchmarks/serve_load.py --requests 5000 --concurrency 64 --max-batch-size 32
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SNIPPETS = [
+    'If Ivanka weren\'t my daughter, perhaps I\'d be dating her.',
+    'Simon, walking in front of Ralph, felt a flicker of incredulity',
+    'the boy glanced over his shoulder',
+    'By her own hand was her sword crafted for her',
+    'Attention Ladies and Gentlemen',
+]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def start_server(args):
+    """
+    :return: `(process, url)` of a new server
+    """
+    command = [sys.executable, '-m', 'gender_bender.serve', '--port', '0',
+               '--engine', args.engine, '--max-batch-size', str(args.max_batch_size),
+               '--max-wait-ms', str(args.max_wait_ms)]
+    process = subprocess.Popen(command, cwd=REPO_DIR, stdout=subprocess.PIPE,
+                               universal_newlines=True)
+    # The server prints its address once the models are loaded
+    line = process.stdout.readline()
+    if not line.startswith('Serving on '):
+        process.kill()
+        sys.exit('The server did not start')
+    return process, line.split()[-1]
+
+
+def run(url, num_requests, concurrency):
+    parsed_url = urlparse(url)
+    local = threading.local()
+
+    def request(ii):
+        # One connection per client thread, kept alive between requests
+        if not hasattr(local, 'connection'):
+            local.connection = http.client.HTTPConnection(parsed_url.hostname,
+                                                          parsed_url.port)
+        body = SNIPPETS[ii % len(SNIPPETS)].encode('utf-8')
+        start = time.perf_counter()
+        local.connection.request('POST', '/text', body)
+        response = local.connection.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError('Request failed with status {}'.format(response.status))
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(request, range(num_requests)))
+    duration = time.perf_counter() - start
+    return {
+        'requests': num_requests,
+        'concurrency': concurrency,
+        'requests_per_s': num_requests / duration,
+        'latency_p50_ms': 1000 * percentile(latencies, 0.5),
+        'latency_p90_ms': 1000 * percentile(latencies, 0.9),
+        'latency_p99_ms': 1000 * percentile(latencies, 0.99),
+    }
+
+
+def get_metrics(url):
+    parsed_url = urlparse(url)
+    connection = http.client.HTTPConnection(parsed_url.hostname, parsed_url.port)
+    connection.request('GET', '/metrics')
+    return json.loads(connection.getresponse().read())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', type=str,
+                        help='Address of a running server (by default, one is started)')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--engine', default='document')
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=5)
+    parser.add_argument('--output', type=str, help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    process = None
+    url = args.url
+    if url is None:
+        process, url = start_server(args)
+    try:
+        # Warms up the server (and the connections)
+        run(url, args.concurrency, args.concurrency)
+        results = run(url, args.requests, args.concurrency)
+        metrics = get_metrics(url)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    results['mean_batch_size'] = metrics['mean_batch_size']
+
+    for key, value in results.items():
+        print('{:>16}: {:.1f}'.format(key, value))
+    if args.output:
+        with open(args.output, 'w') as fo:
+            json.dump({'results': results, 'server_metrics': metrics}, fo, indent=2)
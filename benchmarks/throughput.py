@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Measures how fast texts and books get flipped.
+
+Runs `gender_bend` on synthetic texts of growing size (the time exponent shows
+whether flipping scales linearly with the length of the text), and flips each
+epub of `examples/`.  Each run happens in a fresh interpreter and reports its
+characters per second, the time spent in each stage and its peak RSS:
+
+ - `load`: loading spaCy, the language model and the other dependencies
+ - `parse`: reading and decoding the documents of the book
+ - `nlp`: running the spaCy pipeline
+ - `replace`: the rest of the flipping (finding terms, names, ...)
+ - `write`: writing the new book
+
+The results can be saved as JSON, and compared with a previous run to fail on
+a regression of the throughput:
+
+    ./benchmarks/throughput.py --output new.json --baseline old.json --max-regression 0.2
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLES_DIR = os.path.join(REPO_DIR, 'examples')
+DEFAULT_SIZES = (1000, 4000, 16000, 64000)
+
+PARAGRAPHS = [
+    'If Ivanka weren\'t my daughter, perhaps I\'d be dating her.',
+    'Simon, walking in front of Ralph, felt a flicker of incredulity.  He told his '
+    'sister that the King\'s men would come for her by the end of the day.',
+    'The boy glanced over his shoulder, and the actress waved at him from the door of '
+    'her house.',
+    'By her own hand was her sword crafted for her, and she was very proud of it.',
+    'Attention Ladies and Gentlemen: Mrs. Brownlow and her husband are the guests of '
+    'the Queen tonight.',
+]
+
+
+def synthetic_text(size):
+    """A text of about `size` characters, made of paragraphs of prose."""
+    paragraphs = []
+    length = 0
+    while length < size:
+        paragraph = PARAGRAPHS[len(paragraphs) % len(PARAGRAPHS)]
+        paragraphs.append(paragraph)
+        length += len(paragraph) + 2
+    return '\n\n'.join(paragraphs)[:size]
+
+
+def run_case(case):
+    """Runs a single benchmark case in this process.
+
+    :param dict case: `kind` (`text` or `epub`), `engine`, `size` or `path`,
+        and optionally the pipeline `profile`
+    :return: dict of the measurements
+    """
+    from gender_bender.gender_tools import _get_flipper, configure_pipeline
+    from gender_bender.epub import rewrite_epub
+
+    stages = dict.fromkeys(['load', 'parse', 'nlp', 'replace', 'write'], 0)
+    start = time.perf_counter()
+    if 'profile' in case:
+        configure_pipeline(profile=case['profile'])
+    flipper = _get_flipper(case['engine'])
+    # Also loads the dependencies that are only imported once needed
+    flipper.flip_gender(PARAGRAPHS[1])
+    stages['load'] = time.perf_counter() - start
+    stats = flipper.enable_stats()
+
+    flip_seconds = 0
+    num_chars = 0
+    if case['kind'] == 'text':
+        text = synthetic_text(case['size'])
+        num_chars = len(text)
+        start = time.perf_counter()
+        flipper.flip_gender(text)
+        flip_seconds = time.perf_counter() - start
+    else:
+        # Same pipeline as `gender_bend_epub()`, with the reading of the
+        # documents and their flipping timed separately from the writing
+        def flip_texts(texts):
+            nonlocal flip_seconds, num_chars
+            texts = iter(texts)
+            while True:
+                start = time.perf_counter()
+                try:
+                    text = next(texts)
+                except StopIteration:
+                    return
+                finally:
+                    stages['parse'] += time.perf_counter() - start
+                num_chars += len(text)
+                start = time.perf_counter()
+                flipped_text = flipper.flip_gender(text)
+                flip_seconds += time.perf_counter() - start
+                yield flipped_text
+
+        output_path = os.path.join(case['tmp_dir'], os.path.basename(case['path']))
+        start = time.perf_counter()
+        rewrite_epub(case['path'], output_path, flip_texts)
+        stages['write'] = time.perf_counter() - start - stages['parse'] - flip_seconds
+
+    stages['nlp'] = stats.seconds['nlp']
+    stages['replace'] = flip_seconds - stats.seconds['nlp']
+    total_seconds = sum(stages.values()) - stages['load']
+    # `ru_maxrss` is in kilobytes on Linux, and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        max_rss *= 1024
+    return {
+        'chars': num_chars,
+        'seconds': total_seconds,
+        'chars_per_s': num_chars / total_seconds if total_seconds else None,
+        'stages_s': stages,
+        'peak_rss_mb': max_rss / 1024 ** 2,
+        'counts': dict(stats.counts),
+    }
+
+
+def run_case_in_subprocess(case):
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--case', json.dumps(case)],
+        cwd=REPO_DIR, stdout=subprocess.PIPE, universal_newlines=True, check=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def time_exponent(results):
+    """Slope of log(time) against log(size): about 1 if flipping is linear in
+    the length of the text, 2 if it's quadratic.
+    """
+    points = [(math.log(result['chars']), math.log(result['seconds']))
+              for result in results if result['seconds'] > 0]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    return (sum((x - mean_x) * (y - mean_y) for x, y in points)
+            / sum((x - mean_x) ** 2 for x, _ in points))
+
+
+def find_regressions(results, baseline, max_regression):
+    """
+    :return: list of the names of the runs whose throughput dropped by more
+        than the `max_regression` fraction since `baseline`
+    """
+    regressions = []
+    for name, result in results['runs'].items():
+        previous = baseline['runs'].get(name)
+        if not previous or not previous['chars_per_s'] or not result['chars_per_s']:
+            continue
+        if result['chars_per_s'] < (1 - max_regression) * previous['chars_per_s']:
+            regressions.append(name)
+    return regressions
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=REPO_DIR, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--engines', nargs='+', default=['word', 'document', 'fast'])
+    parser.add_argument('--sizes', nargs='*', type=int, default=DEFAULT_SIZES,
+                        help='Sizes of the synthetic texts, in characters')
+    parser.add_argument('--books', nargs='*',
+                        default=sorted(os.path.join(EXAMPLES_DIR, name)
+                                       for name in os.listdir(EXAMPLES_DIR)
+                                       if name.endswith('.epub')),
+                        help='Epubs to flip (by default, those of `examples/`)')
+    parser.add_argument('--output', type=str, help='JSON file to write the results to')
+    parser.add_argument('--baseline', type=str,
+                        help='JSON file of previous results to compare with')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='Fail if the throughput of a run drops by more than this '
+                             'fraction of the baseline')
+    parser.add_argument('--case', type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        sys.path.insert(0, REPO_DIR)
+        print(json.dumps(run_case(json.loads(args.case))))
+        sys.exit()
+
+    import tempfile
+
+    results = {
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'revision': _git_revision(),
+        'python': sys.version.split()[0],
+        'runs': {},
+        'time_exponents': {},
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for engine in args.engines:
+            text_results = []
+            cases = [('text/{}/{}'.format(engine, size),
+                      {'kind': 'text', 'engine': engine, 'size': size})
+                     for size in args.sizes]
+            cases += [('epub/{}/{}'.format(engine, os.path.basename(path)),
+                       {'kind': 'epub', 'engine': engine, 'path': os.path.abspath(path),
+                        'tmp_dir': tmp_dir})
+                      for path in args.books]
+            for name, case in cases:
+                result = results['runs'][name] = run_case_in_subprocess(case)
+                if case['kind'] == 'text':
+                    text_results.append(result)
+                print('{:<48} {:>10.0f} chars/s {:>8.2f} s {:>8.1f} MB  {}'.format(
+                    name, result['chars_per_s'] or 0, result['seconds'],
+                    result['peak_rss_mb'],
+                    ' '.join('{}={:.2f}'.format(stage, seconds)
+                             for stage, seconds in result['stages_s'].items()),
+                ))
+            exponent = results['time_exponents'][engine] = time_exponent(text_results)
+            if exponent is not None:
+                print('{} engine: time grows as size^{:.2f}'.format(engine, exponent))
+
+    if args.output:
+        with open(args.output, 'w') as fo:
+            json.dump(results, fo, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fo:
+            baseline = json.load(fo)
+        regressions = find_regressions(results, baseline, args.max_regression)
+        if regressions:
+            sys.exit('Throughput dropped by more than {:.0%} for: {}'.format(
+                args.max_regression, ', '.join(regressions)))
@@ -1,2 +1,11 @@
 # -*- coding: utf-8 -*-
-from .gender_tools import gender_bend, gender_bend_epub
+from .async_tools import (AsyncGenderBender, configure_async, gender_bend_async,
+                          gender_bend_epub_async)
+from .batch import gender_bend_books
+from .caches import cache_info, clear_caches, configure_caches
+from .gender_tools import (GenderBender, choose_names, configure_pipeline, disable_disk_cache,
+                           disable_stats, disk_cache_info, enable_disk_cache, enable_stats,
+                           gender_bend, gender_bend_epub, gender_bend_incremental,
+                           gender_bend_many, gender_bend_markup, prescan_names, warmup)
+from .names import NamingSession
+from .pipeline import MissingSpacyModelError
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Coroutines flipping the gender of texts and epubs without blocking the
+event loop.
+
+The work is offloaded to a thread or process executor, and the number of
+pending calls is bounded, so that a burst of requests waits for a slot rather
+than piling up in the executor.
+
+    from gender_bender import gender_bend_async
+    flipped = await gender_bend_async(text)
+"""
+import threading
+import weakref
+
+from . import gender_tools
+from .gender_tools import _warmup_worker, gender_bend, gender_bend_epub
+
+DEFAULT_MAX_PENDING = 64
+
+
+class AsyncGenderBender:
+    def __init__(self, executor=None, max_workers=None, use_processes=False,
+                 max_pending=DEFAULT_MAX_PENDING, engine='word'):
+        """
+        :param executor: `concurrent.futures` executor to run the calls in.  By
+            default, one is created on the first call.
+        :param int max_workers: number of workers of the default executor
+        :param bool use_processes: whether the default executor is a process
+            pool (each process loads the models once) rather than a thread pool
+        :param int max_pending: maximum number of calls running or waiting in
+            the executor, other calls wait for one of them to finish
+        :param str engine: see `gender_bend()`
+        """
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._max_workers = max_workers
+        self._use_processes = use_processes
+        self._max_pending = max_pending
+        self._engine = engine
+        self._lock = threading.Lock()
+        # asyncio semaphores belong to an event loop, so there's one per loop
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    async def gender_bend(self, text):
+        return await self._run(gender_bend, text, False, self._engine)
+
+    async def gender_bend_epub(self, input_path, output_path=None, workers=1,
+                               text_only=False):
+        return await self._run(gender_bend_epub, input_path, output_path, False,
+                               self._engine, workers, None, text_only)
+
+    async def _run(self, function, *args):
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = self._semaphores[loop] = asyncio.Semaphore(self._max_pending)
+        # If the calling task is cancelled while waiting for a slot or while
+        # its call is still queued in the executor, the call never runs.  A
+        # call that already started runs to the end, and keeps its slot until
+        # then.
+        await semaphore.acquire()
+        try:
+            future = self._get_executor().submit(function, *args)
+        except BaseException:
+            semaphore.release()
+            raise
+        future.add_done_callback(lambda _: _release_threadsafe(loop, semaphore))
+        return await asyncio.wrap_future(future)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self._use_processes:
+                    from concurrent.futures import ProcessPoolExecutor
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self._max_workers, mp_context=gender_tools._mp_context,
+                        initializer=_warmup_worker,
+                        initargs=(self._engine, gender_tools._pipeline_config),
+                    )
+                else:
+                    from concurrent.futures import ThreadPoolExecutor
+                    self._executor = ThreadPoolExecutor(max_workers=self._max_workers)
+            return self._executor
+
+    def shutdown(self, wait=True):
+        """Shuts down the executor, if it was created by this object."""
+        with self._lock:
+            if self._owns_executor and self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+
+def _release_threadsafe(loop, semaphore):
+    try:
+        loop.call_soon_threadsafe(semaphore.release)
+    except RuntimeError:
+        # The loop was closed (possibly right after the call was done), so
+        # nothing waits for the semaphore anymore
+        pass
+
+
+_default_async_flipper = AsyncGenderBender()
+
+
+def configure_async(**kwargs):
+    """Replaces the `AsyncGenderBender` used by `gender_bend_async()` and
+    `gender_bend_epub_async()` (see its arguments).
+    """
+    global _default_async_flipper
+    _default_async_flipper.shutdown(wait=False)
+    _default_async_flipper = AsyncGenderBender(**kwargs)
+    return _default_async_flipper
+
+
+async def gender_bend_async(text):
+    return await _default_async_flipper.gender_bend(text)
+
+
+async def gender_bend_epub_async(input_path, output_path=None, workers=1, text_only=False):
+    return await _default_async_flipper.gender_bend_epub(input_path, output_path, workers,
+                                                         text_only)
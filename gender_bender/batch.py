@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""Flipping of many books in one run.
+
+The books are spread across a pool of processes, each loading the spaCy model
+once for all the books it flips.  The outcome of each book (status, timing,
+hashes of the input and output) is appended to a manifest as soon as it's
+known, so that a run that gets interrupted can be started again and only
+flips the books it hadn't got to:
+
+    from gender_bender import gender_bend_books
+    gender_bend_books(['catalogue/', 'new/*.epub'], output_dir='flipped', workers=8)
+"""
+import collections
+import datetime
+import glob
+import hashlib
+import itertools
+import json
+import logging
+import os
+import time
+
+from . import gender_tools
+from .gender_tools import OUTPUT_SUFFIX, default_output_path, gender_bend_epub
+
+MANIFEST_FILE = 'gender_bender_manifest.jsonl'
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def find_books(inputs):
+    """
+    :param inputs: paths of epubs, of directories (searched recursively for
+        epubs, leaving out the books flipped before) or glob patterns
+    :return: list of `(path, relative path)` pairs, without duplicates, the
+        relative path being the one the flipped book gets in an output
+        directory (relative to the directory, or to the folder before the
+        first wildcard of the glob pattern, or the file name of an epub)
+    """
+    return _find_books(inputs)[0]
+
+
+def _find_books(inputs):
+    """
+    :return: the books (see `find_books()`), and the list of the inputs that
+        match no file
+    """
+    books = collections.OrderedDict()
+    unmatched = []
+    for input_ in inputs:
+        if os.path.isdir(input_):
+            for dir_path, dir_names, file_names in os.walk(input_):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    if os.path.splitext(file_name)[1].lower() == '.epub' \
+                            and not _is_flipped_book(file_name):
+                        path = os.path.join(dir_path, file_name)
+                        books.setdefault(os.path.abspath(path),
+                                         (path, os.path.relpath(path, input_)))
+        elif os.path.isfile(input_):
+            books.setdefault(os.path.abspath(input_), (input_, os.path.basename(input_)))
+        else:
+            paths = sorted(glob.glob(input_, recursive=True))
+            if not paths:
+                logging.error('No book found for: %s', input_)
+                unmatched.append(input_)
+            root = _glob_root(input_)
+            for path in paths:
+                if _is_flipped_book(path):
+                    continue
+                books.setdefault(os.path.abspath(path), (path, os.path.relpath(path, root)))
+    return list(books.values()), unmatched
+
+
+def _glob_root(pattern):
+    """
+    :return: the folder the matches of a glob pattern are relative to, the
+        one before its first wildcard (so that `new/**/*.epub` keeps the
+        subfolders of `new/`)
+    """
+    root = os.path.dirname(pattern)
+    while glob.has_magic(root):
+        root = os.path.dirname(root)
+    return root or os.curdir
+
+
+def _is_flipped_book(path):
+    return os.path.splitext(os.path.basename(path))[0].endswith(OUTPUT_SUFFIX)
+
+
+class Manifest:
+    """Outcome of each book of a batch, as JSON lines appended to a file (the
+    last line of a book being its latest outcome).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        if os.path.exists(path):
+            with open(path) as fo:
+                for line in fo:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A line cut short by the interruption of a run
+                        continue
+                    self.records[record['input']] = record
+
+    def add(self, record):
+        self.records[record['input']] = record
+        with open(self.path, 'a') as fo:
+            fo.write(json.dumps(record) + '\n')
+            fo.flush()
+            os.fsync(fo.fileno())
+
+    def is_done(self, input_path, input_sha256, output_path, options):
+        """Whether the book was flipped to `output_path` with the same options,
+        and both are still the same as when it was.
+        """
+        record = self.records.get(input_path)
+        return (record is not None and record['status'] == 'done'
+                and record['options'] == options and record['input_sha256'] == input_sha256
+                and record['output'] == output_path and os.path.exists(output_path)
+                and file_hash(record['output']) == record['output_sha256'])
+
+
+def file_hash(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as fo:
+        for chunk in iter(lambda: fo.read(HASH_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def gender_bend_books(inputs, output_dir=None, manifest_path=None, workers=1,
+                      engine='word', text_only=False):
+    """Flips the gender of many epubs, skipping those a previous run already
+    flipped.
+
+    Each book gets its own naming session.  A book that fails is recorded as
+    such and flipped again by the next run, the other books carrying on.
+
+    :param inputs: see `find_books()`
+    :param str output_dir: folder the books are written to (keeping their
+        path relative to the input directory, see `find_books()`).  By
+        default, each book is written next to its input (see
+        `gender_bend_epub()`).
+    :raises ValueError: when several books would be written to the same path
+    :param str manifest_path: JSON lines file recording the outcome of each
+        book (by default, `MANIFEST_FILE` in the output folder, or the current
+        folder)
+    :param int workers: number of processes the books are spread across
+    :param str engine: see `gender_bend()`
+    :param bool text_only: see `gender_bend_epub()`
+    :return: `collections.Counter` of the number of books flipped (`done`),
+        skipped because they already were (`skipped`) and `failed` (inputs
+        matching no file included)
+    """
+    if manifest_path is None:
+        manifest_path = os.path.join(output_dir or '.', MANIFEST_FILE)
+    manifest = Manifest(manifest_path)
+    options = dict(gender_tools._pipeline_config, engine=engine, text_only=text_only)
+    options.pop('download_model')
+
+    books, unmatched = _find_books(inputs)
+    output_paths = collections.OrderedDict()
+    for input_path, relative_path in books:
+        input_path = os.path.abspath(input_path)
+        if output_dir is None:
+            output_path = default_output_path(input_path)
+        else:
+            output_path = os.path.abspath(os.path.join(output_dir, relative_path))
+        if output_path in output_paths:
+            raise ValueError('{} and {} would both be flipped to {}'.format(
+                output_paths[output_path], input_path, output_path))
+        output_paths[output_path] = input_path
+
+    counts = collections.Counter(done=0, skipped=0, failed=len(unmatched))
+    tasks = []
+    for output_path, input_path in output_paths.items():
+        input_sha256 = file_hash(input_path)
+        if manifest.is_done(input_path, input_sha256, output_path, options):
+            counts['skipped'] += 1
+            continue
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        tasks.append((input_path, input_sha256, output_path, engine, text_only))
+    logging.info('%s books to flip, %s already flipped', len(tasks), counts['skipped'])
+
+    for index, record in enumerate(_flip_books(tasks, engine, workers), 1):
+        record['options'] = options
+        manifest.add(record)
+        counts[record['status']] += 1
+        logging.info('%s %s (%s/%s) in %.1f s', record['status'].capitalize(),
+                     record['input'], index, len(tasks), record['seconds'])
+    return counts
+
+
+def _flip_books(tasks, engine, workers):
+    """
+    :return: generator of the manifest records of the books, in order of
+        completion
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield _flip_book(*task)
+        return
+
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=gender_tools._mp_context,
+                             initializer=_init_worker,
+                             initargs=(engine, gender_tools._pipeline_config,
+                                       gender_tools._disk_cache)) as executor:
+        tasks = iter(tasks)
+        pending = set()
+        while True:
+            # At most two books per worker are queued at once
+            for task in itertools.islice(tasks, 2 * workers - len(pending)):
+                pending.add(executor.submit(_flip_book, *task))
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def _init_worker(engine, pipeline_config, disk_cache):
+    gender_tools._disk_cache = disk_cache
+    gender_tools._warmup_worker(engine, pipeline_config)
+
+
+def _flip_book(input_path, input_sha256, output_path, engine, text_only):
+    record = {'input': input_path, 'input_sha256': input_sha256}
+    start = time.perf_counter()
+    try:
+        output_path = gender_bend_epub(input_path, output_path, engine=engine,
+                                       text_only=text_only)
+    except Exception as error:
+        logging.exception('Could not flip %s', input_path)
+        record.update(status='failed', error='{}: {}'.format(type(error).__name__, error))
+    else:
+        record.update(status='done', output=os.path.abspath(output_path),
+                      output_sha256=file_hash(output_path))
+    record.update(seconds=time.perf_counter() - start,
+                  finished_at=datetime.datetime.now().isoformat(timespec='seconds'))
+    return record
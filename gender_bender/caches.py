@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Bounded caches around the pure (but slow) functions used while flipping.
+
+Each cache is a `functools.lru_cache`, so it's safe to share across threads,
+and can be inspected with `cache_info()` and resized with
+`configure_caches()`.
+"""
+import functools
+import threading
+
+DEFAULT_MAXSIZE = 4096
+
+_caches = {}
+_lock = threading.Lock()
+
+
+class CachedFunction:
+    def __init__(self, function, maxsize=DEFAULT_MAXSIZE):
+        functools.update_wrapper(self, function)
+        self._function = function
+        self._cached = functools.lru_cache(maxsize)(function)
+
+    def __call__(self, *args):
+        return self._cached(*args)
+
+    def resize(self, maxsize):
+        """Replaces the cache by an empty one holding at most `maxsize` results
+        (or an unbounded one if `maxsize` is `None`).
+        """
+        self._cached = functools.lru_cache(maxsize)(self._function)
+
+    def cache_info(self):
+        return self._cached.cache_info()
+
+    def cache_clear(self):
+        self._cached.cache_clear()
+
+
+def cached(name, maxsize=DEFAULT_MAXSIZE):
+    """Decorator registering a function's cache under `name`."""
+    def decorator(function):
+        with _lock:
+            if name in _caches:
+                raise ValueError('Cache already registered: "{}"'.format(name))
+            _caches[name] = CachedFunction(function, maxsize)
+        return _caches[name]
+    return decorator
+
+
+def cache_info():
+    """
+    :return: dict of cache name to its `functools` `CacheInfo` (hits, misses,
+        maxsize, currsize)
+    """
+    with _lock:
+        return {name: cache.cache_info() for name, cache in _caches.items()}
+
+
+def configure_caches(maxsize=DEFAULT_MAXSIZE, **maxsizes):
+    """Resizes (and so empties) the caches.
+
+    :param maxsize: maximum number of results every cache holds, `None` for
+        unbounded caches
+    :param maxsizes: maximum size of specific caches, by name, e.g.
+        `configure_caches(gender=100000)`
+    """
+    with _lock:
+        unknown_names = set(maxsizes) - set(_caches)
+        if unknown_names:
+            raise ValueError('Unknown caches: {}'.format(', '.join(sorted(unknown_names))))
+        for name, cache in _caches.items():
+            cache.resize(maxsizes.get(name, maxsize))
+
+
+def clear_caches():
+    with _lock:
+        for cache in _caches.values():
+            cache.cache_clear()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Read-only mappings of strings to strings, stored in files that are
+memory-mapped rather than loaded.
+
+The pages of a memory-mapped file belong to the OS page cache, so the
+processes mapping the same file (e.g. the workers forked from a parent that
+opened it, see `prefork`) share a single copy of it, which Python never
+writes to.  A dict, on the other hand, ends up copied into every worker as
+soon as the reference counts of its strings change.
+
+The file is a hash table with open addressing: a header, then the offsets of
+the entries in their slots (0 for an empty slot), then the entries (lengths
+of the key and the value, then both in UTF-8).  Keys are hashed with CRC-32,
+which unlike `hash()` is the same in every process.
+"""
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+import zlib
+
+MAGIC = b'GBTABLE1'
+_HEADER = struct.Struct('<8sII')
+_SLOT = struct.Struct('<I')
+_ENTRY = struct.Struct('<HH')
+# At most half of the slots are used, so lookups probe few slots
+_SLOTS_PER_ENTRY = 2
+
+
+class CompactTable:
+    def __init__(self, path):
+        """
+        :param str path: file written by `write_compact_table()`
+        """
+        import mmap
+
+        self.path = path
+        with open(path, 'rb') as fo:
+            self._mmap = mmap.mmap(fo.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._num_slots, self._num_entries = _HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            self._mmap.close()
+            raise ValueError('Not a compact table: {}'.format(path))
+
+    def _find(self, key):
+        """
+        :return: offset of the value of `key` and its length, or `None`
+        """
+        key = _encode(key)
+        slot = zlib.crc32(key) % self._num_slots
+        while True:
+            offset, = _SLOT.unpack_from(self._mmap, _HEADER.size + _SLOT.size * slot)
+            if offset == 0:
+                return None
+            key_length, value_length = _ENTRY.unpack_from(self._mmap, offset)
+            key_start = offset + _ENTRY.size
+            if self._mmap[key_start:key_start + key_length] == key:
+                return key_start + key_length, value_length
+            slot = (slot + 1) % self._num_slots
+
+    def get(self, key, default=None):
+        found = self._find(key)
+        if found is None:
+            return default
+        start, length = found
+        return self._mmap[start:start + length].decode('utf-8', 'surrogatepass')
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __len__(self):
+        return self._num_entries
+
+    def close(self):
+        self._mmap.close()
+
+
+def write_compact_table(mapping, path):
+    """Writes a dict of strings to strings as a `CompactTable` file (through
+    a temporary file, so that concurrent processes never read a partly
+    written one).
+    """
+    num_slots = max(_SLOTS_PER_ENTRY * len(mapping), 1)
+    slots = [0] * num_slots
+    entries = []
+    offset = _HEADER.size + _SLOT.size * num_slots
+    for key, value in mapping.items():
+        key, value = _encode(key), _encode(value)
+        slot = zlib.crc32(key) % num_slots
+        while slots[slot]:
+            slot = (slot + 1) % num_slots
+        slots[slot] = offset
+        entry = _ENTRY.pack(len(key), len(value)) + key + value
+        entries.append(entry)
+        offset += len(entry)
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, 'wb') as fo:
+        fo.write(_HEADER.pack(MAGIC, num_slots, len(mapping)))
+        fo.write(struct.pack('<{}I'.format(num_slots), *slots))
+        fo.writelines(entries)
+    os.replace(tmp_path, path)
+
+
+def load_compact_table(name, fingerprint, load_mapping):
+    """Opens the compact table of a mapping, writing it first if it doesn't
+    exist yet.
+
+    :param str name: what the mapping is (e.g. `term_mapper`)
+    :param str fingerprint: hash of everything the mapping depends on
+    :param load_mapping: function returning the mapping as a dict (or `None`
+        if there's none)
+    :return: `CompactTable`, or the dict itself if the table can't be written
+        (or `None`)
+    """
+    path = compact_table_path(name, fingerprint)
+    try:
+        return CompactTable(path)
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, struct.error) as error:
+        logging.warning('Ignoring unreadable compact table %s: %s', path, error)
+
+    mapping = load_mapping()
+    if mapping is None:
+        return None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_compact_table(mapping, path)
+        return CompactTable(path)
+    except OSError as error:
+        logging.warning('Could not write compact table %s: %s', path, error)
+        return mapping
+
+
+def compact_table_path(name, fingerprint):
+    cache_dir = os.environ.get('XDG_CACHE_HOME', os.path.expanduser(os.path.join('~', '.cache')))
+    file_name = '{}-{}.table'.format(name, hashlib.sha1(fingerprint.encode()).hexdigest())
+    return os.path.join(cache_dir, 'gender_bender', 'tables', file_name)
+
+
+def _encode(text):
+    return text.encode('utf-8', 'surrogatepass')
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Cache of flipped texts persisted in a SQLite database, so that texts seen
+in a previous run (e.g. the unchanged chapters of a book, or boilerplate
+repeated across books) don't get flipped again.
+
+The least recently used entries are evicted once the values stored add up to
+more than the size limit.  Their total size is kept up to date along with the
+entries, so that writing one doesn't go through the whole table.
+"""
+import collections
+import json
+import os
+import threading
+import time
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+# Seconds a process waits for another one writing to the database
+DEFAULT_TIMEOUT = 30
+
+DiskCacheInfo = collections.namedtuple('DiskCacheInfo',
+                                       ['hits', 'misses', 'entries', 'size', 'max_size'])
+
+
+def default_cache_path():
+    cache_dir = os.environ.get('XDG_CACHE_HOME', os.path.expanduser(os.path.join('~', '.cache')))
+    return os.path.join(cache_dir, 'gender_bender', 'flipped_texts.sqlite3')
+
+
+class DiskCache:
+    def __init__(self, path=None, max_size=DEFAULT_MAX_SIZE):
+        """
+        :param str path: path of the database (by default, in the user's cache
+            folder)
+        :param int max_size: maximum total size of the cached values, in bytes
+        """
+        self.path = path or default_cache_path()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    def __getstate__(self):
+        # The connection can't cross process boundaries, each process opens its
+        # own
+        return {'path': self.path, 'max_size': self.max_size}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _connect(self):
+        if self._connection is None or self._pid != os.getpid():
+            # Only imported once the cache is used, to keep the import of the
+            # package light
+            import sqlite3
+
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=DEFAULT_TIMEOUT,
+                                               check_same_thread=False,
+                                               isolation_level=None)
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+                'last_used REAL NOT NULL)'
+            )
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)'
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS total (id INTEGER PRIMARY KEY CHECK (id = 0), '
+                'size INTEGER NOT NULL)'
+            )
+            # Only sums the entries up when the table is new
+            self._connection.execute(
+                'INSERT OR IGNORE INTO total '
+                'SELECT 0, COALESCE(SUM(size), 0) FROM entries'
+            )
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key):
+        """
+        :param str key: hash of everything the value depends on
+        :return: the JSON-serializable value stored under `key`, or `None`
+        """
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute('SELECT value FROM entries WHERE key = ?',
+                                     (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            connection.execute('UPDATE entries SET last_used = ? WHERE key = ?',
+                               (time.time(), key))
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        # JSON escapes the lone surrogates of undecodable bytes, which SQLite
+        # would reject
+        value = json.dumps(value)
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute('BEGIN IMMEDIATE')
+                row = connection.execute('SELECT size FROM entries WHERE key = ?',
+                                         (key,)).fetchone()
+                connection.execute(
+                    'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                    (key, value, len(value), time.time()),
+                )
+                self._add_size(connection, len(value) - (row[0] if row else 0))
+                self._evict(connection)
+
+    def _add_size(self, connection, size):
+        connection.execute('UPDATE total SET size = size + ?', (size,))
+
+    def _evict(self, connection):
+        excess = connection.execute('SELECT size FROM total').fetchone()[0] - self.max_size
+        if excess <= 0:
+            return
+        evicted_keys = []
+        evicted_size = 0
+        for key, size in connection.execute(
+                'SELECT key, size FROM entries ORDER BY last_used'):
+            evicted_keys.append((key,))
+            evicted_size += size
+            if evicted_size >= excess:
+                break
+        connection.executemany('DELETE FROM entries WHERE key = ?', evicted_keys)
+        self._add_size(connection, -evicted_size)
+
+    def info(self):
+        """
+        :rtype: DiskCacheInfo
+        """
+        with self._lock:
+            connection = self._connect()
+            entries, = connection.execute('SELECT COUNT(*) FROM entries').fetchone()
+            size, = connection.execute('SELECT size FROM total').fetchone()
+            return DiskCacheInfo(self.hits, self.misses, entries, size, self.max_size)
+
+    def clear(self):
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.execute('BEGIN IMMEDIATE')
+                connection.execute('DELETE FROM entries')
+                connection.execute('UPDATE total SET size = 0')
+            self.hits = self.misses = 0
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Streaming rewrite of epubs.
+
+An epub is a zip archive.  The members are rewritten one at a time into a new
+archive with the same order, names, timestamps and compression, so styling
+and other resources come out exactly as they went in.  Only the (X)HTML
+documents listed in the book's manifest are decoded and handed over to be
+rewritten, everything else (images, fonts, CSS, ...) is streamed through in
+chunks.
+"""
+import logging
+import posixpath
+import shutil
+import zipfile
+from urllib.parse import unquote
+from xml.etree import ElementTree
+
+CONTAINER_PATH = 'META-INF/container.xml'
+DOCUMENT_MEDIA_TYPES = {'application/xhtml+xml', 'text/html'}
+# Used when the manifest can't be read
+DOCUMENT_EXTENSIONS = ('.xhtml', '.html', '.htm')
+COPY_CHUNK_SIZE = 1024 * 1024
+
+_CONTAINER_NS = '{urn:oasis:names:tc:opendocument:xmlns:container}'
+_OPF_NS = '{http://www.idpf.org/2007/opf}'
+
+
+def iter_documents(input_path):
+    """Decodes the documents of an epub one at a time.
+
+    :return: generator of `(member name, text)` pairs, in archive order
+    """
+    with zipfile.ZipFile(input_path) as zin:
+        document_names = _document_names(zin)
+        for info in zin.infolist():
+            if info.filename in document_names:
+                yield info.filename, _decode(zin.read(info))
+
+
+def rewrite_epub(input_path, output_path, rewrite_texts):
+    """Copies an epub, rewriting the text of its documents.
+
+    :param rewrite_texts: function taking an iterator over the texts of the
+        documents (in archive order) and returning an iterator over their new
+        texts, in the same order.  The texts are read as the new texts are
+        consumed, so a lazy function keeps a single document in memory.
+    """
+    with zipfile.ZipFile(input_path) as zin, zipfile.ZipFile(output_path, 'w') as zout:
+        document_names = _document_names(zin)
+        document_infos = [info for info in zin.infolist()
+                          if info.filename in document_names]
+        new_texts = iter(rewrite_texts(_decode(zin.read(info)) for info in document_infos))
+
+        for ii, info in enumerate(zin.infolist()):
+            if info.filename in document_names:
+                logging.debug('Rewriting epub member %s/%s: %s', ii, len(zin.infolist()) - 1,
+                              info.filename)
+                zout.writestr(info, _encode(next(new_texts)))
+            else:
+                with zin.open(info) as src, zout.open(info, 'w') as dst:
+                    shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+
+
+def _decode(content):
+    # Undecodable bytes are kept as surrogates, so they're written back as
+    # they were
+    return content.decode('utf-8', 'surrogateescape')
+
+
+def _encode(text):
+    return text.encode('utf-8', 'surrogateescape')
+
+
+def _document_names(zin):
+    """Finds the (X)HTML documents of an epub from the manifest of its package
+    document (falling back on file extensions).
+
+    :return: set of archive member names
+    """
+    try:
+        container = ElementTree.fromstring(zin.read(CONTAINER_PATH))
+        document_names = set()
+        for rootfile in container.iter(_CONTAINER_NS + 'rootfile'):
+            opf_path = rootfile.get('full-path')
+            opf_dir = posixpath.dirname(opf_path)
+            package = ElementTree.fromstring(zin.read(opf_path))
+            for item in package.iter(_OPF_NS + 'item'):
+                if item.get('media-type') in DOCUMENT_MEDIA_TYPES:
+                    href = unquote(item.get('href', '').split('#')[0])
+                    document_names.add(posixpath.normpath(posixpath.join(opf_dir, href)))
+        if document_names:
+            return document_names
+    except (KeyError, TypeError, ElementTree.ParseError) as error:
+        logging.warning('Could not read the epub manifest (%s), finding documents '
+                        'by extension instead', error)
+    return {name for name in zin.namelist() if name.lower().endswith(DOCUMENT_EXTENSIONS)}
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Lightweight tokenizing and part-of-speech tagging for the `fast` engine.
+
+The only decision of the word-by-word flipping that needs the POS tags is
+whether a `her`/`his` is genitive (`her dog` -> `his dog`) or not (`saw her`
+-> `saw him`), which depends on the first determiner, noun, conjunction or
+adposition following it.  So instead of running spaCy, the words are looked up
+in a small lexicon of the closed word classes (and of common verbs, adverbs
+and adjectives), unknown words being tagged from their suffix, and otherwise
+as nouns.  The tags are the coarse ones of spaCy (`DET`, `NOUN`, ...).
+"""
+import re
+
+# The words that are most often tagged as such (e.g. `that` is usually a
+# subordinating conjunction after a pronoun: `told her that ...`)
+_WORD_CLASSES = {
+    'DET': '''
+        a an another any each either every neither no some the these this those
+        all both
+    ''',
+    'ADP': '''
+        aboard about above across after against along amid amidst among amongst
+        around as at before behind below beneath beside besides between beyond
+        by despite down during except for from in inside into like near of off
+        on onto out outside over past per round since than through throughout
+        till to toward towards under underneath unlike until unto up upon via
+        with within without
+    ''',
+    'CCONJ': '''
+        and but nor or plus yet
+    ''',
+    'SCONJ': '''
+        although because if once that though unless whereas whether while
+        whilst
+    ''',
+    'PRON': '''
+        anybody anyone anything everybody everyone everything he her hers
+        herself him himself his i it its itself me mine my myself nobody none
+        nothing one our ours ourselves she somebody someone something their
+        theirs them themselves they us we what whatever which who whoever whom
+        whose you your yours yourself yourselves
+    ''',
+    'AUX': '''
+        am are be been being ca can could did do does done had has have having
+        is may might must ought shall should was were will wo would
+    ''',
+    'PART': '''
+        not n't 's '
+    ''',
+    'ADV': '''
+        again ago almost alone already also always anyway anywhere away back
+        else elsewhere enough even ever everywhere far forth forward here
+        hence how however indeed instead just later least less more most much
+        never next now nowhere often only perhaps quite rather really
+        seldom so sometimes somewhat somewhere soon still then there thereby
+        therefore thus today together tomorrow tonight too very well when
+        whence where why yes yesterday
+    ''',
+    'ADJ': '''
+        able afraid alive angry asleep awake bad beautiful best better big
+        black blue bright brown certain clean clear close cold common dark
+        dead dear deep different difficult dry early easy empty entire few
+        fine first free fresh full glad good great green happy hard heavy
+        high hot huge important large last late little long loud low many
+        new nice old other own pale poor pretty quick quiet ready real red
+        rich right sad safe same several short sick silent simple small soft
+        sorry strange strong sure sweet tall terrible thin tired true ugly
+        various warm weak white whole wide wild wise wrong young
+    ''',
+    'VERB': '''
+        add allow appear ask beat become became begin began begun believe bind
+        bite bled bleed blew blow break bring broke brought build built bury buy
+        came carry catch caught chose choose come consider continue cried dealt
+        die dig draw drawn drew drive drove dug eat ate eaten expect explain
+        fallen fed feed feel fell felt find flee fled flew fling flung fly
+        follow forbade forbid forget forgive forgot forgotten found gave get
+        give given go gone got grew grow hang happen hate hear heard held hid
+        hide hold hung keep kept kill knew know known laid lay lean learn leave
+        led left lend lent let listen live lose lost made make marry mean meant
+        meet met move open paid pay pick please put raise ran read remain
+        remember rid rode rose said sang sat saw say see seem seen sell send
+        sent shook shut sing sit slay slept slew sold sought speak spend spent
+        spoke spoken stand stole stood strike struck suppose take taken taught
+        teach tear tell thank think thought threw throw told took tore tried try
+        understand understood wake want wear went win woke won wore worn wrote
+        write
+    ''',
+}
+_LEXICON = {word: tag for tag, words in _WORD_CLASSES.items() for word in words.split()}
+
+# Tokens of a phrase: words (with their clitics), numbers, and any other
+# character
+_TOKEN_REGEX = re.compile("[a-zA-Z]+(?:'[a-zA-Z]+)*'?|[0-9]+|\\S")
+# Clitics split off a word the way spaCy does it, e.g. `queen's` -> `queen`,
+# `don't` -> `do`
+_CLITIC_REGEX = re.compile("(?:n't|'(?:s|ll|re|ve|d|m)?)\\Z", re.IGNORECASE)
+
+
+def split_term(word):
+    """
+    :param str word: run of letters and apostrophes
+    :return: the first token of `word`, e.g. `queen` for `queen's`
+    """
+    if word.startswith('\''):
+        # spaCy splits opening quotes off
+        return '\''
+    return _CLITIC_REGEX.sub('', word, count=1) or word
+
+
+def tag_word(word):
+    """
+    :param str word: token (see `tag_words()`)
+    :return: coarse POS tag of the token
+    """
+    lower_word = split_term(word).lower()
+    tag = _LEXICON.get(lower_word)
+    if tag is not None:
+        return tag
+    if not lower_word[0].isalpha():
+        return 'NUM' if lower_word[0].isdigit() else 'PUNCT'
+    if word[0].isupper():
+        return 'PROPN'
+    if lower_word.endswith('ly'):
+        return 'ADV'
+    if lower_word.endswith('ing') or (lower_word.endswith('ed')
+                                      and not lower_word.endswith('eed')):
+        return 'VERB'
+    return 'NOUN'
+
+
+def tag_words(text):
+    """
+    :return: list of the coarse POS tags of the tokens of `text`
+    """
+    return [tag_word(token) for token in _TOKEN_REGEX.findall(text)]
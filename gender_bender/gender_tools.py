@@ -1,304 +1,969 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import bisect
+import collections
+import difflib
+import hashlib
 import itertools
+import json
 import logging
 import os
 import re
-
-from ebooklib import epub
-import gender_guesser.detector as gender_detector
-import spacy
-from termcolor import colored
-from titlecase import titlecase
-
-from .pluralize import pluralize
-
-
-logging.basicConfig(level=logging.INFO)  # TODO Why does this not work??  Move into __init__.py
-
-# lazy-loaded singleton that's responsible for all the work
-_flipper = None
-
-
-def gender_bend(text, interactive_naming=False):
-    global _flipper
-    if _flipper is None:
-        logging.debug('Initializing gender flipping object')
-        _flipper = _GenderBender()
-
-    return _flipper.flip_gender(text, interactive_naming)
-
-
-def gender_bend_epub(input_path, output_path=None, interactive_naming=False):
+import threading
+import time
+
+from .compact_table import load_compact_table
+from .disk_cache import DEFAULT_MAX_SIZE, DiskCache
+from .epub import iter_documents, rewrite_epub
+from . import fast_tagger
+from .language_model import (MissingLanguageModelError, get_model_dir,  # noqa: F401
+                             load_language_model)
+from .markup import BLOCK_SEPARATOR, MarkupDocument
+from .name_table import load_name_table, name_table_fingerprint
+from .names import NameIndex, NamingSession, name_gender, suggest_name, titlecase
+from .pipeline import (DEFAULT_PROFILE, DEFAULT_SPACY_MODEL,  # noqa: F401
+                       MissingSpacyModelError, check_profile, load_pipeline)
+from .stats import FlipStats, TimedNlp, timed
+from .term_matcher import TermMatcher, normalize_term
+
+# The third-party dependencies (spaCy in particular) are slow to import, so
+# they're imported where they're first needed rather than here
+
+
+# A word is a run of letters and apostrophes, anything else is a boundary
+_WORD_REGEX = re.compile("[a-zA-Z']+")
+# The phrase following a term ends at a tag delimiter or a full stop
+_PHRASE_END_CHARS = '<>.'
+_PHRASE_END_REGEX = re.compile('[{}]'.format(re.escape(_PHRASE_END_CHARS)))
+# In the text of a markup document, it ends at the end of a block instead
+_TEXT_PHRASE_END_REGEX = re.compile('[.]|' + BLOCK_SEPARATOR)
+# Ends at the words that start a sentence: those that aren't preceded by a
+# letter or a parenthesis, ignoring whitespace
+_SENTENCE_START_REGEX = re.compile('(?:\\A|[^a-zA-Z)( \n\t])[ \n\t]*(?=[a-zA-Z\'])')
+
+# Ways of running spaCy over the text:
+#  - `word`: the pipeline is run separately on each word (and on the phrase
+#    following a `her`/`his`), which is slow but what the tests were tuned on
+#  - `document`: the pipeline is run once over the whole text, so each word is
+#    tagged in the context of its sentence
+#  - `fast`: spaCy isn't used at all, the words are tagged with the small
+#    lexicon of `fast_tagger`, and names are only found with the name lists
+ENGINES = ('word', 'document', 'fast')
+
+# The spaCy pipeline and the language models are immutable once loaded, so
+# they're loaded once per process and shared by every `GenderBender`
+_shared_resources = {}
+_shared_resources_lock = threading.Lock()
+
+# lazy-loaded flippers (one per engine) used by the functions below
+_flippers = {}
+_flippers_lock = threading.Lock()
+# `FlipStats` shared by those flippers, see `enable_stats()`
+_stats = None
+# Whether those flippers use memory-mapped tables, see `prefork.preload()`
+_compact_tables = False
+# `multiprocessing` context the worker pools start their processes with (by
+# default, the platform's).  `prefork.preload()` sets it to `fork`, so that
+# the workers inherit the models loaded up front.
+_mp_context = None
+# spaCy pipeline of those flippers (`GenderBender` arguments), see
+# `configure_pipeline()`
+_pipeline_config = {
+    'spacy_model': DEFAULT_SPACY_MODEL,
+    'pipeline_profile': DEFAULT_PROFILE,
+    'download_model': False,
+}
+
+# The naming session of a worker process of `_gender_bend_in_pool()`
+_worker_session = None
+
+# Added to the name of a book for the name of the flipped book, by default
+OUTPUT_SUFFIX = '_gender_bent'
+
+# `DiskCache` of flipped texts, see `enable_disk_cache()`
+_disk_cache = None
+# Bump this whenever a change to the code changes the flipped texts, so that
+# stale cached texts aren't used
+CACHE_FORMAT_VERSION = 2
+
+
+def gender_bend(text, interactive_naming=False, engine='word', session=None):
+    """Flips the gender of a text.
+
+    :param interactive_naming: whether the user is prompted for the new name
+        of each name, or a function `(name, context, suggested_name)` called
+        instead of the prompt, returning its answer (the new name, `s` for
+        the suggested name, or `n` if it's not a name)
+
+    :param NamingSession session: names chosen so far, e.g. for the previous
+        chapters of a book (the names of this text are added to it).  By
+        default, the text gets its own session.
+    """
+    flipper = _get_flipper(engine)
+    return _flip_with_disk_cache(flipper, flipper.flip_gender, 'text', text,
+                                 interactive_naming, session)
+
+
+def gender_bend_incremental(old_text, old_flipped_text, new_text, interactive_naming=False,
+                            engine='word', session=None):
+    """Flips an edited text, only flipping again the lines that changed since
+    a previous version of it was flipped.
+
+    :param str old_text: previous version of the text
+    :param str old_flipped_text: `old_text` flipped
+    :param str new_text: the edited text
+    :param NamingSession session: the session `old_text` was flipped in, so
+        that names chosen interactively stay the same
+    """
+    return _get_flipper(engine).flip_gender_incremental(
+        old_text, old_flipped_text, new_text, interactive_naming, session)
+
+
+def gender_bend_markup(document, interactive_naming=False, engine='word', session=None):
+    """Flips the gender of the text of an (X)HTML document, leaving its markup
+    (tags, attribute values, scripts, ...) as is.
+
+    :param NamingSession session: see `gender_bend()`
+    """
+    flipper = _get_flipper(engine)
+    return _flip_with_disk_cache(flipper, flipper.flip_markup, 'markup', document,
+                                 interactive_naming, session)
+
+
+def gender_bend_many(texts, batch_size=64, n_process=1, session=None):
+    """Flips the gender of many texts, parsing them in batches with spaCy.
+
+    The texts are consumed lazily and the results are yielded in the same
+    order, so only about `batch_size` texts are held in memory at once however
+    long `texts` is.
+
+    :param texts: iterable of strings
+    :param int batch_size: number of texts spaCy parses at once
+    :param int n_process: number of processes spaCy parses with
+    :param NamingSession session: session shared by all the texts (by default,
+        each text gets its own)
+    :return: generator of the flipped texts
+    """
+    return _get_flipper('document').flip_gender_many(texts, batch_size, n_process,
+                                                     session)
+
+
+def warmup(engine='word'):
+    """Loads the spaCy model and the language model ahead of the first call,
+    e.g. when a server starts.
+    """
+    _get_flipper(engine)
+
+
+def configure_pipeline(spacy_model=DEFAULT_SPACY_MODEL, profile=DEFAULT_PROFILE,
+                       download=False):
+    """Chooses the spaCy pipeline used by the functions of this module (and by
+    their worker processes).
+
+    :param str spacy_model: name of an installed spaCy model, or path of one
+    :param str profile: which components of the model are loaded, see
+        `pipeline.PIPELINE_PROFILES`
+    :param bool download: whether the model gets downloaded if it isn't
+        installed
+    """
+    global _pipeline_config
+    check_profile(profile)
+    with _flippers_lock:
+        _pipeline_config = {
+            'spacy_model': spacy_model,
+            'pipeline_profile': profile,
+            'download_model': download,
+        }
+        # The flippers get created again with the new pipeline
+        _flippers.clear()
+
+
+def enable_disk_cache(path=None, max_size=DEFAULT_MAX_SIZE):
+    """Caches the texts flipped by `gender_bend()`, `gender_bend_markup()` and
+    `gender_bend_epub()` (document by document) on disk, so that flipping them
+    again is just a lookup.
+
+    Texts are cached by their content, the language model, the spaCy model
+    (and pipeline profile) and the engine.  Calls with interactive naming are never cached.
+
+    :param str path: path of the SQLite database (by default, in the user's
+        cache folder)
+    :param int max_size: maximum total size of the cached texts, in bytes
+    :rtype: DiskCache
+    """
+    global _disk_cache
+    disable_disk_cache()
+    _disk_cache = DiskCache(path, max_size)
+    return _disk_cache
+
+
+def disable_disk_cache():
+    global _disk_cache
+    if _disk_cache is not None:
+        _disk_cache.close()
+    _disk_cache = None
+
+
+def disk_cache_info():
+    """
+    :return: `DiskCacheInfo` (hits, misses, entries, size, max_size), or
+        `None` if the disk cache isn't enabled
+    """
+    return _disk_cache.info() if _disk_cache is not None else None
+
+
+def enable_stats(callback=None):
+    """Starts collecting the counters and stage timings of the texts flipped by
+    the functions of this module (in this process, so not in the workers of
+    `gender_bend_epub()`).
+
+    :param callback: see `FlipStats`
+    :rtype: FlipStats
+    """
+    global _stats
+    with _flippers_lock:
+        _stats = FlipStats(callback)
+        for flipper in _flippers.values():
+            flipper.stats = _stats
+    return _stats
+
+
+def disable_stats():
+    global _stats
+    with _flippers_lock:
+        _stats = None
+        for flipper in _flippers.values():
+            flipper.stats = None
+
+
+def _flip_with_disk_cache(flipper, flip, mode, text, interactive_naming, session):
+    disk_cache = _disk_cache
+    if disk_cache is None or interactive_naming:
+        return flip(text, interactive_naming, session)
+    if session is None:
+        session = NamingSession()
+
+    key = flipper.cache_key(text, mode, session)
+    cached_value = disk_cache.get(key)
+    stats = flipper.stats
+    if cached_value is not None:
+        session.name_mapper.update(cached_value['names'])
+        if stats is not None:
+            text_stats = FlipStats()
+            text_stats.counts.update(texts=1, chars=len(text), disk_cache_hits=1)
+            stats.add(text_stats)
+        return cached_value['text']
+    if stats is not None:
+        stats.increment('disk_cache_misses')
+
+    # Without interactive naming, the session only gets new names, which are
+    # cached along with the text
+    known_names = set(session.name_mapper)
+    flipped_text = flip(text, session=session)
+    new_names = {name: new_name for name, new_name in session.name_mapper.items()
+                 if name not in known_names}
+    disk_cache.set(key, {'text': flipped_text, 'names': new_names})
+    return flipped_text
+
+
+def default_output_path(input_path):
+    """
+    :return: path of the flipped book, next to the book
+    """
+    base, ext = os.path.splitext(input_path)
+    return '{}{}{}'.format(base, OUTPUT_SUFFIX, ext)
+
+
+def _get_flipper(engine='word'):
+    with _flippers_lock:
+        if engine not in _flippers:
+            logging.debug('Initializing gender flipping object')
+            _flippers[engine] = GenderBender(engine=engine, compact_tables=_compact_tables,
+                                             **_pipeline_config)
+            _flippers[engine].stats = _stats
+        return _flippers[engine]
+
+
+def gender_bend_epub(input_path, output_path=None, interactive_naming=False,
+                     engine='word', workers=1, session=None, text_only=False):
+    """Flips the gender of an epub.
+
+    The book is rewritten one document at a time, and everything but its
+    (X)HTML documents is copied over as is.
+
+    :param int workers: number of processes the documents of the book are
+        spread across (each of them loads its own spaCy model)
+    :param NamingSession session: names to use for the book (the names of the
+        book are added to it).  By default, the book gets its own session.
+    :param bool text_only: whether only the text nodes of the documents are
+        flipped (see `gender_bend_markup()`), rather than the raw documents
+    :return: path of the new epub (by default, next to `input_path`)
+    """
+    if workers > 1 and interactive_naming:
+        raise ValueError('Interactive naming needs a single worker')
     if output_path is None:
-        base, ext = os.path.splitext(output_path)
-        output_path = '{}_gender_bent{}'.format(base, ext)
-    book = epub.read_epub(input_path)
-
-    for ii, item in enumerate(book.items):
-        logging.debug('Working on epub item {}/{}'.format(ii, len(book.items)-1))
-        try:
-            content = item.content.decode()
-        except UnicodeDecodeError:
-            logging.error('Decode Error on book item: %s', ii)
-            continue
-        content = gender_bend(content, interactive_naming)
-        item.content = content.encode()
+        output_path = default_output_path(input_path)
+    if session is None:
+        session = NamingSession()
+
+    flip = gender_bend_markup if text_only else gender_bend
+    if workers > 1:
+        def flip_texts(texts):
+            return _gender_bend_in_pool(texts, flip, engine, workers, session)
+    else:
+        def flip_texts(texts):
+            return _gender_bend_sequentially(texts, flip, interactive_naming, engine,
+                                             session)
+    rewrite_epub(input_path, output_path, flip_texts)
+    return output_path
+
+
+def prescan_names(input_path, engine='word', text_only=False, session=None):
+    """Finds the names of an epub, in one pass over the book without any
+    prompt, so that they can all be chosen up front (see `choose_names()`).
+
+    :param NamingSession session: names that are already chosen, and so
+        aren't returned
+    :return: list of `(name, context, suggested_name)` tuples, in order of
+        first appearance
+    """
+    names = []
+
+    def add_name(name, context, suggested_name):
+        names.append((name, context, suggested_name))
+        # Left as is for now, and not found again
+        return 'n'
+
+    if session is None:
+        session = NamingSession()
+    scan_session = NamingSession(session.name_mapper, session.not_names)
+    flip = gender_bend_markup if text_only else gender_bend
+    for _, text in iter_documents(input_path):
+        flip(text, add_name, engine, scan_session)
+    return names
+
+
+def choose_names(names, session):
+    """Prompts for the new name of each name, adding the answers to the
+    session.
+
+    :param names: names as returned by `prescan_names()`
+    """
+    for name, context, suggested_name in names:
+        input_ = _get_new_name_from_user(name, context, suggested_name)
+        _add_chosen_name(session, name.lower(), input_, suggested_name)
+
+
+def _gender_bend_sequentially(texts, flip, interactive_naming, engine, session):
+    for text in texts:
+        yield flip(text, interactive_naming, engine, session)
+
+
+def _gender_bend_in_pool(texts, flip, engine, workers, session):
+    """Flips `texts` with `flip` across a pool of processes, yielding them back
+    in order.
+
+    At most two texts per worker are in flight at once.  Without interactive
+    naming, the name a name gets mapped to only depends on the name itself, so
+    each worker comes up with the same mapping as a sequential run would.
+    Workers are seeded with the names already in `session`, and the names they
+    map are merged back into it.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context,
+                             initializer=_init_worker,
+                             initargs=(engine, session.name_mapper, session.not_names,
+                                       _disk_cache, _pipeline_config)) as executor:
+        pending = collections.deque()
+        texts = iter(texts)
+        while True:
+            for text in itertools.islice(texts, 2 * workers - len(pending)):
+                pending.append(executor.submit(_gender_bend_in_worker, flip, text, engine))
+            if not pending:
+                return
+            flipped_text, name_mapper = pending.popleft().result()
+            for name, new_name in name_mapper.items():
+                session.name_mapper.setdefault(name, new_name)
+            yield flipped_text
+
+
+def _init_worker(engine, name_mapper, not_names, disk_cache, pipeline_config):
+    global _worker_session, _disk_cache
+    _warmup_worker(engine, pipeline_config)
+    _worker_session = NamingSession(name_mapper, not_names)
+    _disk_cache = disk_cache
+
+
+def _warmup_worker(engine, pipeline_config):
+    """Loads the spaCy model once per worker process, with the pipeline of the
+    parent process.
+    """
+    global _pipeline_config
+    _pipeline_config = pipeline_config
+    _get_flipper(engine)
+
+
+def _gender_bend_in_worker(flip, text, engine):
+    flipped_text = flip(text, engine=engine, session=_worker_session)
+    return flipped_text, _worker_session.name_mapper
+
+
+def _load_shared(key, loader):
+    with _shared_resources_lock:
+        if key not in _shared_resources:
+            _shared_resources[key] = loader()
+        return _shared_resources[key]
+
+
+def _load_language_model(language_model, compact_tables=False):
+    model = load_language_model(language_model)
+    # Terms that aren't a single word can't be found by looking words up, so
+    # they're matched separately
+    phrases = [term for term in model.term_mapper if not _WORD_REGEX.fullmatch(term)]
+    term_mapper = model.term_mapper
+    if compact_tables:
+        term_mapper = load_compact_table('term_mapper', model.fingerprint,
+                                         lambda: model.term_mapper)
+    name_table = load_name_table(get_model_dir(language_model), model.fingerprint,
+                                 compact_tables)
+    return (term_mapper, TermMatcher(phrases), NameIndex(model.female_names),
+            NameIndex(model.male_names), model.fingerprint, name_table,
+            name_table_fingerprint(model.fingerprint) if name_table is not None else None)
 
-    # Strangely, when I write it back out, it loses it center styling (at least for
-    # the oliver twist ePub.  This happens even if I don't modify it at all.
-    epub.write_epub(output_path, book)
 
+# TODO: break into NameFlipper and WordFlipper?
+class GenderBender:
+    """Flips the gender of texts.
+
+    The heavy pieces (the spaCy pipeline, the term mapper and the name
+    indexes) are loaded once per process and shared by all instances, while
+    the names chosen for a document are kept in a `NamingSession`, so an
+    instance can be used from several threads at once.
+
+    :ivar FlipStats stats: counters and timings of the texts flipped, if
+        they're being collected (see `enable_stats()`)
+    """
+    def __init__(self, language_model='english', engine='word',
+                 spacy_model=DEFAULT_SPACY_MODEL, pipeline_profile=DEFAULT_PROFILE,
+                 download_model=False, compact_tables=False):
+        """
+        :param str spacy_model: name of an installed spaCy model, or path of one
+        :param str pipeline_profile: which components of the model are loaded,
+            see `pipeline.PIPELINE_PROFILES`
+        :param bool download_model: whether the spaCy model gets downloaded if
+            it isn't installed (otherwise, `MissingSpacyModelError` is raised)
+        :param bool compact_tables: whether the term mapper and the name table
+            are memory-mapped `CompactTable`s (shared by forked processes
+            without being copied, see `prefork`) rather than dicts
+        """
+        if engine not in ENGINES:
+            raise ValueError('Unknown engine: "{}" (choose from: {})'.format(
+                engine, ', '.join(ENGINES)))
+        check_profile(pipeline_profile)
+        self._engine = engine
+        if engine == 'fast':
+            self._nlp = None
+            self._pipeline_profile = None
+        else:
+            self._nlp = _load_shared(
+                ('spacy', spacy_model, pipeline_profile),
+                lambda: load_pipeline(spacy_model, pipeline_profile, download_model),
+            )
+            self._pipeline_profile = pipeline_profile
+        (self._term_mapper, self._phrase_matcher, self._female_names,
+         self._male_names, self._language_model_fingerprint, self._name_table,
+         self._name_table_fingerprint) = _load_shared(
+            ('language_model', language_model, compact_tables),
+            lambda: _load_language_model(language_model, compact_tables),
+        )
+        self.stats = None
 
-class MissingLanguageModelError(Exception):
-    pass
+    def enable_stats(self, callback=None):
+        """Starts collecting the counters and stage timings of the texts
+        flipped.
 
+        :param callback: see `FlipStats`
+        :rtype: FlipStats
+        """
+        self.stats = FlipStats(callback)
+        return self.stats
 
-# TODO: break into NameFlipper and WordFlipper?
-class _GenderBender:
-    def __init__(self, language_model='english'):
-        self._gender_detector = gender_detector.Detector()
-        self._name_mapper = {}
-        self._not_names = set()
+    def disable_stats(self):
+        self.stats = None
 
+    def flip_gender(self, text, interactive_naming=False, session=None, doc=None):
+        """
+        :param NamingSession session: names chosen so far (by default, the text
+            gets its own session)
+        :param doc: spaCy `Doc` of `text`, if it has already been parsed
+        """
+        if session is None:
+            session = NamingSession()
+
+        def flip(text_stats):
+            # The flipped text is assembled from segments in a single pass,
+            # rather than splicing each replacement into the whole string
+            segments = []
+            last_end = 0
+            for start, end, replacement in self._find_replacements(
+                    text, session, interactive_naming, doc, stats=text_stats):
+                segments.append(text[last_end:start])
+                segments.append(replacement)
+                last_end = end
+            segments.append(text[last_end:])
+
+            return timed(text_stats, 'rebuild', lambda: ''.join(segments).strip())
+        return self._flip_with_stats(text, flip)
+
+    def flip_gender_incremental(self, old_text, old_flipped_text, new_text,
+                                interactive_naming=False, session=None):
+        """Flips `new_text`, an edited version of `old_text`, reusing the lines
+        of `old_flipped_text` for the lines that didn't change.
+
+        With the `word` and `fast` engines, the result is the same as flipping
+        `new_text` from scratch.  With the `document` engine, the changed lines
+        are only parsed along with the rest of their last phrase, rather than in
+        the context of the whole text.
+
+        :param NamingSession session: see `gender_bend_incremental()`
+        """
+        if session is None:
+            session = NamingSession()
+        # Flipping strips the text, so the lines are matched on stripped texts
+        new_text = new_text.strip()
+        old_lines = old_text.strip().splitlines(keepends=True)
+        old_flipped_lines = old_flipped_text.splitlines(keepends=True)
+        new_lines = new_text.splitlines(keepends=True)
+        if len(old_lines) != len(old_flipped_lines):
+            # A term spanning several lines was flipped, so the lines of the
+            # flipped text don't match those of the text anymore
+            return self.flip_gender(new_text, interactive_naming, session)
+
+        line_starts = [0]
+        for line in new_lines:
+            line_starts.append(line_starts[-1] + len(line))
+        # Lines of `new_text` to flip again: those that changed, and the lines
+        # before them whose last phrase runs into a change (or a deletion)
+        old_line_indexes = {}
+        changed_ranges = []
+        matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+        for tag, old_start, _, new_start, new_end in matcher.get_opcodes():
+            if tag == 'equal':
+                for ii in range(new_start, new_end):
+                    old_line_indexes[ii] = old_start + ii - new_start
+                continue
+            last_phrase_end = max(new_text.rfind(char, 0, line_starts[new_start])
+                                  for char in _PHRASE_END_CHARS)
+            first_word = _WORD_REGEX.search(new_text, last_phrase_end + 1,
+                                            line_starts[new_start])
+            if first_word is None:
+                start = new_start
+            else:
+                start = bisect.bisect_right(line_starts, first_word.start()) - 1
+            if changed_ranges and start <= changed_ranges[-1][1]:
+                start = changed_ranges.pop()[0]
+            changed_ranges.append((start, new_end))
+
+        segments = []
+        next_line = 0
+        for start, end in changed_ranges + [(len(new_lines), len(new_lines))]:
+            segments.extend(old_flipped_lines[old_line_indexes[ii]]
+                            for ii in range(next_line, start))
+            if end > start:
+                flipped_lines = self._flip_lines(new_text, line_starts[start],
+                                                 line_starts[end], session,
+                                                 interactive_naming)
+                if flipped_lines is None:
+                    return self.flip_gender(new_text, interactive_naming, session)
+                segments.append(flipped_lines)
+            next_line = max(end, next_line)
+        return ''.join(segments).strip()
+
+    def _flip_lines(self, text, start, end, session, interactive_naming):
+        """Flips `text[start:end]`, a run of whole lines of `text`.
+
+        Whether a term gets flipped, and to what, only depends on the text up
+        to the end of the phrase that follows it, so the lines are flipped
+        along with the lines that this phrase runs into.
+
+        :return: the flipped lines, or `None` if a flipped term runs over the
+            end of the lines
+        """
+        window_end = text.find('\n', _phrase_end(text, end))
+        window = text[start:window_end if window_end != -1 else len(text)]
+        end -= start
+        segments = []
+        last_end = 0
+        for term_start, term_end, replacement in self._find_replacements(
+                window, session, interactive_naming):
+            if term_start >= end:
+                break
+            if term_end > end:
+                return None
+            segments.append(window[last_end:term_start])
+            segments.append(replacement)
+            last_end = term_end
+        segments.append(window[last_end:end])
+        return ''.join(segments)
+
+    def flip_markup(self, document, interactive_naming=False, session=None):
+        """
+        :param NamingSession session: see `flip_gender()`
+        """
+        if session is None:
+            session = NamingSession()
+        markup_document = MarkupDocument(document)
+
+        def flip(text_stats):
+            replacements = list(self._find_replacements(
+                markup_document.text, session, interactive_naming,
+                phrase_end_regex=_TEXT_PHRASE_END_REGEX, stats=text_stats,
+            ))
+            return timed(text_stats, 'rebuild', markup_document.splice, replacements)
+        return self._flip_with_stats(markup_document.text, flip)
+
+    def _flip_with_stats(self, text, flip):
+        """Calls `flip` with the `FlipStats` to collect the stats of `text`
+        into, or `None` if stats aren't being collected.
+        """
+        stats = self.stats
+        if stats is None:
+            return flip(None)
+        text_stats = FlipStats()
+        start = time.perf_counter()
+        flipped_text = flip(text_stats)
+        text_stats.seconds['total'] = time.perf_counter() - start
+        text_stats.counts.update(texts=1, chars=len(text),
+                                 words=len(_WORD_REGEX.findall(text)))
+        stats.add(text_stats)
+        return flipped_text
+
+    def cache_key(self, text, mode, session=None):
+        """Hash of everything the flipped `text` depends on.
+
+        :param str mode: how the text is flipped (e.g. `markup` for
+            `flip_markup()`)
+        :param NamingSession session: session the text is flipped in, whose
+            names found in the text are part of the key (e.g. a name loaded
+            from a file that the name table doesn't know)
+        """
+        nlp_meta = self._nlp.meta if self._nlp is not None else {}
+        session_names = [[], []]
+        if session is not None:
+            # A name can only change the flipped text if the text contains it
+            lower_text = text.lower()
+            session_names = [
+                sorted(item for item in session.name_mapper.items() if item[0] in lower_text),
+                sorted(name for name in session.not_names if name in lower_text),
+            ]
+        key = json.dumps([
+            CACHE_FORMAT_VERSION, self._language_model_fingerprint,
+            self._name_table_fingerprint, nlp_meta.get('name'), nlp_meta.get('version'),
+            self._pipeline_profile, self._engine, mode, session_names,
+        ])
+        hasher = hashlib.sha256(key.encode())
+        hasher.update(text.encode('utf-8', 'surrogateescape'))
+        return hasher.hexdigest()
+
+    def flip_gender_many(self, texts, batch_size=64, n_process=1, session=None):
+        if self._nlp is None:
+            # Nothing to parse ahead of time
+            for text in texts:
+                yield self.flip_gender(text, session=session)
+            return
+        stats = self.stats
+        nlp = self._nlp
+        if stats is not None:
+            # The time spent parsing the batches isn't part of any single text
+            parse_stats = FlipStats()
+            nlp = TimedNlp(nlp, parse_stats)
         try:
-            self._nlp = spacy.load('en_core_web_sm')
-        except OSError:
-            # At the moment, this seems to be the best solution with the requirement of
-            # publishing this on PyPI (https://stackoverflow.com/a/55704556/2223706)
-            logging.info('Downloading language model for the spaCy POS tagger '
-                         '(don\'t worry, this will only happen once)')
-            from spacy.cli import download
-            download('en_core_web_sm')
-            self._nlp = spacy.load('en_core_web_sm')
-
-        self._term_mapper = {}
-        model_dir = os.path.join(os.path.dirname(__file__), 'language_models')
-        female_file = os.path.join(model_dir, language_model, 'female_names')
-        if not os.path.exists(female_file):
-            raise MissingLanguageModelError(
-                'Non-existent female name file: "{}"'.format(female_file)
-            )
-        male_file = os.path.join(model_dir, language_model, 'male_names')
-        if not os.path.exists(male_file):
-            raise MissingLanguageModelError(
-                'Non-existent male name file: "{}"'.format(male_file)
-            )
-        with open(female_file) as fo:
-            self._female_names = [name.strip() for name in fo.readlines()]
-        with open(male_file) as fo:
-            self._male_names = [name.strip() for name in fo.readlines()]
-
-        word_file = os.path.join(model_dir, language_model, 'words')
-        if not os.path.exists(word_file):
-            raise MissingLanguageModelError(
-                'Non-existent word file: "{}"'.format(word_file)
-            )
-        with open(word_file) as fo:
-            for line in fo:
-                # logging.debug('language file line: %s', line)
-                if re.match(' *#', line) or re.match(' *\n\Z', line):
-                    continue
-
-                unidirectional = '=>' in line
-
-                try:
-                    terms_0_str, terms_1_str = line.split('=')
-                    terms_1_str = terms_1_str.lstrip('>')
-                except ValueError:
-                    logging.warning('Invalid line: %s', line)
-                    continue
-                terms_0 = [tt.strip().lower() for tt in terms_0_str.split(',')]
-                terms_1 = [tt.strip().lower() for tt in terms_1_str.split(',')]
-
-                for term_0, term_1 in itertools.product(terms_0, terms_1):
-                    self._term_mapper.update({term_0: term_1})
-                    if not unidirectional:
-                        self._term_mapper.update({term_1: term_0})
-
-                    # avoid `him = her` becoming `them = their`
-                    if pluralize(term_0) in {'them', 'their'}:
-                        continue
-
-                    self._term_mapper.update(
-                        {pluralize(term_0): pluralize(term_1)}
-                    )
-                    if not unidirectional:
-                        self._term_mapper.update(
-                            {pluralize(term_1): pluralize(term_0)}
-                        )
-
-    def flip_gender(self, text, interactive_naming=False):
-        # Pad spaces at the ends since our current algorithm relies on findining
-        # non-letters to find word boundaries
-        text = ' ' + text + ' '
-        idx = 0
-        while idx < len(text) - 1:
-            idx += 1
-            WORD_CHAR_REGEX = 'a-zA-Z\''
-            if re.match('[{}]'.format(WORD_CHAR_REGEX), text[idx-1]):
-                # This is the middle of a word
+            for doc in nlp.pipe(texts, batch_size=batch_size, n_process=n_process):
+                yield self.flip_gender(doc.text, session=session, doc=doc)
+        finally:
+            if stats is not None:
+                stats.add(parse_stats)
+
+    def _find_replacements(self, text, session, interactive_naming=False, doc=None,
+                           phrase_end_regex=_PHRASE_END_REGEX, stats=None):
+        """Finds the terms of `text` that need to be flipped.
+
+        :param phrase_end_regex: regex matching the end of the phrase
+            following a term
+        :param FlipStats stats: stats of the text, if they're being collected
+
+        :return: generator of `(start, end, replacement)` tuples, in order of
+            appearance in `text`
+        """
+        nlp = self._nlp
+        if stats is not None and nlp is not None:
+            nlp = TimedNlp(nlp, stats)
+        if self._engine == 'fast':
+            analyzer = _FastAnalyzer(text)
+        elif doc is not None:
+            analyzer = _DocumentAnalyzer(text, [(0, doc)], nlp.tokenizer)
+        elif self._engine == 'document':
+            analyzer = _DocumentAnalyzer(text, self._parse(text, nlp), nlp.tokenizer)
+        else:
+            analyzer = _WordAnalyzer(text, nlp)
+
+        phrase_end = 0
+        for word_match in _WORD_REGEX.finditer(text):
+            idx = word_match.start()
+            if idx < phrase_end:
+                # This word is part of the previous multi-word term
                 continue
-            if not re.match('[{}]'.format(WORD_CHAR_REGEX), text[idx]):
-                # Not the beginning of a word
+            phrase_end = self._phrase_matcher.match(text, idx) or 0
+            if phrase_end:
+                phrase = text[idx:phrase_end]
+                replacement = _copy_case(phrase, self._term_mapper[normalize_term(phrase)])
+                logging.debug('Replacing %s with %s', phrase, replacement)
+                if stats is not None:
+                    stats.counts['terms_replaced'] += 1
+                yield idx, phrase_end, replacement
                 continue
 
-            remaining_text = text[idx:]
-            # if re.search('\A[a-zA-Z]', test_text):
-            #     # This is the middle of a word
-            #     continue
-            term = re.split('[^{}]'.format(WORD_CHAR_REGEX), remaining_text, 1)[0]
-            # print(term)
-            # from ipdb import set_trace; set_trace(context=21)
             # Prevent something like `queen's` from being considered a single
             # word
-            term = str(self._nlp(term)[0])
-            preceeding_text = text[:idx]
-            # previous_term = re.split('[^{}]'.format(WORD_CHAR_REGEX),
-            #                          preceeding_text.strip())[-1]
-            following_phrase = re.split('[<>.]', text[idx+len(term):], 1)[0]
-            # if term.endswith('\'s'):
-            #     term = term.strip('\'s')
-
-            # print('Assessing: `{}`'.format(term))
-            # from ipdb import set_trace; set_trace(context=21)
-            # logging.info('idx %s / %s', idx, len(text))
+            term = analyzer.split_term(idx, word_match.end())
+
             if term.lower() in self._term_mapper:
-                replacement = self._get_replacement(term, following_phrase)
-                text = text[:idx] + replacement + text[idx+len(term):]
+                replacement = self._get_replacement(term, text, idx + len(term),
+                                                    analyzer, phrase_end_regex)
+                if stats is not None:
+                    stats.counts['terms_replaced'] += 1
+                yield idx, idx + len(term), replacement
                 continue
 
             #####  Flip names ######
-            new_name = self.flip_name(text, idx, term, interactive_naming)
+            new_name = self.flip_name(text, idx, term, analyzer, session,
+                                      interactive_naming, stats)
             if new_name is not None:
                 new_name = _copy_case(term, new_name)
                 logging.debug('Replacing name: %s with %s', term, new_name)
-                text = text[:idx] + new_name + text[idx+len(term):]
-                continue
+                if stats is not None:
+                    stats.counts['names_replaced'] += 1
+                yield idx, idx + len(term), new_name
 
+    def _parse(self, text, nlp):
+        """Runs the spaCy pipeline `nlp` over the whole of `text`.
 
-                # if self._is_proper_noun(text, idx, term)
+        Texts longer than spaCy's `max_length` are parsed in chunks split on
+        line breaks.
 
-        # Strip the spaces we introduced at the beginning of function
-        return text.strip()
-
-    def flip_name(self, text, idx, term, interactive_naming=False):
-        # print(self._not_names)
-        if term[0].islower() or term.lower() in self._not_names:
+        :return: list of `(offset, doc)` pairs
+        """
+        offsets = [0]
+        max_length = nlp.max_length
+        while len(text) - offsets[-1] > max_length:
+            split = text.rfind('\n', offsets[-1] + 1, offsets[-1] + max_length)
+            if split == -1:
+                split = offsets[-1] + max_length
+            offsets.append(split)
+        chunks = [text[start:end] for start, end in zip(offsets, offsets[1:] + [len(text)])]
+        return list(zip(offsets, nlp.pipe(chunks)))
+
+    def flip_name(self, text, idx, term, analyzer, session, interactive_naming=False,
+                  stats=None):
+        if term[0].islower() or term.lower() in session.not_names:
             return None
         # We try a couple different ways to identify if this is a name, since
         # none work perfectly.  Note: false negatives (missing a true name) is
         # much worse than a false positive (thinking a non-name word is name)
         # TODO: Our name detection is still poor... spaCy doesn't work well,
         # should I just get a huge list of names for this purpose?
-        doc = self._nlp(term)
-        ent_type = doc[0].ent_type_  # TODO: is this working??
-        if (ent_type == 'PERSON'
-            or term.lower() in self._male_names
-            or term.lower() in self._female_names
-            or (not ent_type and self._is_proper_noun(text, idx, term))):
-
-            lterm = term.lower()
-
-            if lterm.lower() not in self._name_mapper:
-                context = text[idx-40:idx+40]
-                orig_gender = self._gender_detector.get_gender(titlecase(lterm))
-                logging.debug('name: {} identified as: {}'.format(term, orig_gender))
-                # for `mostly_female`/`mostly_male`, we'll just treat it as
-                # `female`/`male`.
-                orig_gender = orig_gender.lstrip('mostly_')
-                if orig_gender == 'andy':
-                    # androgynous name, so it can map to itself
-                    suggested_name = lterm
-                elif orig_gender == 'unknown':
-                    suggested_name = None
-                else:
-                    suggested_name = self._generate_suggested_name(lterm,
-                                                                   orig_gender)
+        lterm = term.lower()
+        # The lists are checked first, as they're much cheaper than the
+        # entity type
+        is_name = lterm in self._male_names or lterm in self._female_names
+        if not is_name:
+            ent_type = analyzer.entity_type(idx, term)  # TODO: is this working??
+            is_name = (ent_type == 'PERSON'
+                       or (not ent_type and self._is_proper_noun(idx, term, analyzer)))
+        if is_name:
+            if stats is not None:
+                stats.counts['names_detected'] += 1
+
+            if lterm.lower() not in session.name_mapper:
+                context = text[max(idx-40, 0):idx+40]
+                if not interactive_naming and self._name_table is not None:
+                    # The name it flips to is known ahead of time
+                    new_name = self._name_table.get(lterm)
+                    if new_name is None:
+                        return term
+                    session.name_mapper[lterm] = new_name
+                    return new_name
+
+                orig_gender = timed(stats, 'gender', name_gender, lterm, self._female_names,
+                                    self._male_names)
+                logging.debug('name: %s identified as: %s', term, orig_gender)
+                suggested_name = timed(stats, 'suggest', self._generate_suggested_name,
+                                       lterm, orig_gender)
 
                 if not interactive_naming and suggested_name is None:
                     return term
                 if interactive_naming:
-                    input_ = _get_new_name_from_user(term, context, suggested_name)
-                    # TODO: this logic belongs in the above function, not here
-                    if input_ == 'n':
-                        self._not_names.add(lterm)
+                    get_new_name = (interactive_naming if callable(interactive_naming)
+                                    else _get_new_name_from_user)
+                    input_ = get_new_name(term, context, suggested_name)
+                    if not _add_chosen_name(session, lterm, input_, suggested_name):
                         return None
-                    elif input_ == 's':
-                        name = suggested_name
-                    else:
-                        name = input_
                 else:
-                    name = suggested_name
-                self._name_mapper[lterm] = name.lower()
+                    session.name_mapper[lterm] = suggested_name.lower()
 
-            return self._name_mapper[lterm]
+            return session.name_mapper[lterm]
         return None
 
     def _generate_suggested_name(self, orig_name, orig_gender):
         """Chooses a name from the opposite gender with the largest common
-        prefix.
+        prefix (androgynous names map to themselves).
 
-        :param str orig_gender: Either `female` or `male`
-        :return: the suggested name
+        :param str orig_gender: see `name_gender()`
+        :return: the suggested name, or `None` if the gender is unknown
         """
-        if orig_gender == 'female':
-            names = self._male_names
-        else:
-            names = self._female_names
-        suggested_name = None
-        for num_chars in range(1, len(orig_name)):
-            for name in names:
-                if name.startswith(orig_name[:num_chars]):
-                    suggested_name = titlecase(name)
-                    break
-            else:
-                # Ok, there's no better match, so we take the last match
-                break
+        suggested_name = suggest_name(orig_name, orig_gender, self._female_names,
+                                      self._male_names)
+        return titlecase(suggested_name) if suggested_name is not None else None
 
-        return suggested_name
-
-    def _get_replacement(self, term, following_phrase):
+    def _get_replacement(self, term, text, end, analyzer,
+                         phrase_end_regex=_PHRASE_END_REGEX):
         replacement = self._term_mapper[term.lower()]
-        if replacement.lower() == 'him' and self._is_genitive_declension(following_phrase):
-            replacement = 'his'
-        if replacement.lower() == 'hers' and self._is_genitive_declension(following_phrase):
-            replacement = 'her'
+        if (replacement.lower() in {'him', 'hers'} and self._is_genitive_declension(
+                analyzer.pos_tags(end, _phrase_end(text, end, phrase_end_regex)))):
+            replacement = 'his' if replacement.lower() == 'him' else 'her'
         replacement = _copy_case(term, replacement)
         logging.debug('Replacing %s with %s', term, replacement)
         return replacement
 
     @staticmethod
-    def _is_proper_noun(text, idx, term):
+    def _is_proper_noun(idx, term, analyzer):
         # TODO: need to improve this...
-        is_start_of_sentence = not re.search('[a-zA-Z)(][ \n\t]*\Z', text[:idx])
-
-        if is_start_of_sentence:
+        if analyzer.is_sentence_start(idx):
             # TODO: Poor assumption, but I'll improve this later
             return False
 
         return term[0].isupper() and len(term[0]) > 1
 
-    def _is_genitive_declension(self, following_phrase):
-        doc = self._nlp(following_phrase)
-        for term in doc:
-            if term.pos_ in {'NOUN', 'DET'}:
+    @staticmethod
+    def _is_genitive_declension(following_pos_tags):
+        for pos in following_pos_tags:
+            if pos in {'NOUN', 'DET'}:
                 # The "determiner" POS is because you can't have
                 # `... by her the dog ...`, you could have though,
                 # `... by her the quickest way possible ...`
                 return True
-            if term.pos_ in {'ADV', 'ADJ'}:
+            if pos in {'ADV', 'ADJ'}:
                 # Adjectives may preced the object, as in `
                 # ... by her very own mother ...`
                 continue
-            if term.pos_ in {'CCONJ', 'ADP'}:
+            if pos in {'CCONJ', 'ADP'}:
                 # Ex: `... created by her very quickly and ...`
                 # (ADP is also a conjunction)
                 return False
 
 
+class _Analyzer:
+    """Analysis of a text shared by the engines."""
+    def __init__(self, text):
+        self._text = text
+        self._sentence_starts = None
+
+    def is_sentence_start(self, idx):
+        """Whether the word at `idx` starts a sentence, i.e. isn't preceded by
+        a letter or a parenthesis (ignoring whitespace).
+        """
+        if self._sentence_starts is None:
+            # Found in a single sweep over the text, the first time it's needed
+            self._sentence_starts = {match.end() for match
+                                     in _SENTENCE_START_REGEX.finditer(self._text)}
+        return idx in self._sentence_starts
+
+
+class _WordAnalyzer(_Analyzer):
+    """Runs the spaCy pipeline separately on each word (or phrase) of the text
+    that needs to be analyzed.
+    """
+    def __init__(self, text, nlp):
+        super().__init__(text)
+        self._nlp = nlp
+        # The entity type of a word only depends on the word itself, so each
+        # (capitalized) word of the text is only run through the pipeline once
+        self._entity_types = {}
+
+    def split_term(self, idx, word_end):
+        return str(self._nlp(self._text[idx:word_end])[0])
+
+    def entity_type(self, idx, term):
+        ent_type = self._entity_types.get(term)
+        if ent_type is None:
+            ent_type = self._entity_types[term] = self._nlp(term)[0].ent_type_
+        return ent_type
+
+    def pos_tags(self, start, end):
+        return [token.pos_ for token in self._nlp(self._text[start:end])]
+
+
+class _FastAnalyzer(_Analyzer):
+    """Splits and tags the words of the text with `fast_tagger`, without
+    spaCy.  Names aren't recognized as entities, they're only found in the
+    name lists.
+    """
+    def split_term(self, idx, word_end):
+        return fast_tagger.split_term(self._text[idx:word_end])
+
+    def entity_type(self, idx, term):
+        return ''
+
+    def pos_tags(self, start, end):
+        return fast_tagger.tag_words(self._text[start:end])
+
+
+class _DocumentAnalyzer(_Analyzer):
+    """Reads the tokens, entity types and POS tags of the text from a single
+    parse of the whole text.
+    """
+    def __init__(self, text, parsed_chunks, tokenizer):
+        super().__init__(text)
+        self._tokenizer = tokenizer
+        self._starts = []
+        self._ends = []
+        self._ent_types = []
+        self._pos_tags = []
+        for offset, doc in parsed_chunks:
+            for token in doc:
+                self._starts.append(offset + token.idx)
+                self._ends.append(offset + token.idx + len(token))
+                self._ent_types.append(token.ent_type_)
+                self._pos_tags.append(token.pos_)
+
+    def _token_index(self, idx):
+        return bisect.bisect_right(self._starts, idx) - 1
+
+    def split_term(self, idx, word_end):
+        ii = self._token_index(idx)
+        if (ii < 0 or self._starts[ii] != idx or self._ends[ii] > word_end
+                or '\'' in self._text[idx:word_end]):
+            # spaCy doesn't apply its exceptions for words like `she'll` when
+            # they're glued to other characters (e.g. `Mr.—she'll`), so those
+            # get tokenized on their own
+            return str(self._tokenizer(self._text[idx:word_end])[0])
+        return self._text[idx:self._ends[ii]]
+
+    def entity_type(self, idx, term):
+        ii = self._token_index(idx)
+        return self._ent_types[ii] if ii >= 0 else ''
+
+    def pos_tags(self, start, end):
+        first = bisect.bisect_left(self._starts, start)
+        last = bisect.bisect_left(self._starts, end)
+        return self._pos_tags[first:last]
+
+
 def _get_new_name_from_user(old_name, context, suggested_name):
     # TODO: suggest multiple options for the name
+    from termcolor import colored
+
     colored_context = context.replace(old_name, colored(old_name, 'red'))
     if suggested_name is None:
         colored_suggestion = 'N/A'
@@ -317,13 +982,36 @@ def _get_new_name_from_user(old_name, context, suggested_name):
         if (input_ not in {'n', 's'} and len(input_) < 2) or input_.isspace():
             print('You must input a valid name')
             continue
+        if input_ == 's' and suggested_name is None:
+            print('There is no suggested name')
+            continue
 
         return input_
 
 
+def _add_chosen_name(session, name, input_, suggested_name):
+    """Records the answer given for a name (see `_get_new_name_from_user()`).
+
+    :return: whether `name` is a name
+    """
+    if input_ == 'n':
+        session.not_names.add(name)
+    elif input_ == 's':
+        session.name_mapper[name] = suggested_name.lower()
+    else:
+        session.name_mapper[name] = input_.lower()
+    session.autosave()
+    return input_ != 'n'
+
+
+def _phrase_end(text, idx, phrase_end_regex=_PHRASE_END_REGEX):
+    phrase_end = phrase_end_regex.search(text, idx)
+    return phrase_end.start() if phrase_end else len(text)
+
+
 def _copy_case(example_term, term):
     if example_term[0].isupper():
         term = term[0].upper() + term[1:]
-    if all(char.isupper() for char in example_term):
+    if all(char.isupper() for char in example_term if not char.isspace()):
         term = term.upper()
     return term
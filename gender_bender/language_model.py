@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Loading and compiling of language models.
+
+A language model is a folder with the files: `words`, `female_names` and
+`male_names` (see `language_models/README.md`).  Parsing those (and
+pluralizing every term) is slow, so the parsed model gets compiled into a
+single pickle, which is used for as long as the source files don't change.
+
+To compile language models ahead of time (e.g. when building a container):
+
+    python -m gender_bender.language_model english path/to/other/model
+"""
+import argparse
+import hashlib
+import itertools
+import logging
+import os
+import pickle
+import re
+import tempfile
+
+from .caches import cached
+
+
+LANGUAGE_MODELS_DIR = os.path.join(os.path.dirname(__file__), 'language_models')
+SOURCE_FILES = ('words', 'female_names', 'male_names')
+COMPILED_FILE = 'compiled.pickle'
+# Bump this whenever the content of compiled language models changes, so stale
+# ones get recompiled
+COMPILED_FORMAT_VERSION = 1
+
+
+class MissingLanguageModelError(Exception):
+    pass
+
+
+class LanguageModel:
+    def __init__(self, term_mapper, female_names, male_names, fingerprint):
+        """
+        :param dict term_mapper: lower case term to the term it flips to
+        :param list female_names: lower case female names, in file order
+        :param list male_names: lower case male names, in file order
+        :param str fingerprint: hash of the source files the model was
+            compiled from
+        """
+        self.term_mapper = term_mapper
+        self.female_names = female_names
+        self.male_names = male_names
+        self.fingerprint = fingerprint
+
+    def to_dict(self):
+        return {
+            'term_mapper': self.term_mapper,
+            'female_names': self.female_names,
+            'male_names': self.male_names,
+            'fingerprint': self.fingerprint,
+        }
+
+
+def load_language_model(language_model='english'):
+    """Loads a language model, compiling it if there's no up to date compiled
+    version of it.
+
+    :param str language_model: name of one of the bundled language models, or
+        path of a language model folder
+    :rtype: LanguageModel
+    """
+    model_dir = get_model_dir(language_model)
+    fingerprint = _fingerprint(model_dir)
+    for compiled_path in _compiled_paths(model_dir):
+        model = _read_compiled(compiled_path)
+        if model is not None and model.fingerprint == fingerprint:
+            return model
+
+    logging.debug('Compiling language model: %s', model_dir)
+    model = compile_language_model(model_dir)
+    _write_compiled(model, model_dir)
+    return model
+
+
+def get_model_dir(language_model):
+    """
+    :param str language_model: name of one of the bundled language models, or
+        path of a language model folder, which has to be absolute or contain a
+        separator (e.g. `./english`), so that folders in the working directory
+        don't shadow the bundled models
+    """
+    if os.path.isabs(language_model) or os.sep in language_model:
+        return language_model
+    return os.path.join(LANGUAGE_MODELS_DIR, language_model)
+
+
+def compile_language_model(model_dir):
+    """Parses the source files of a language model.
+
+    :rtype: LanguageModel
+    """
+    word_file, female_file, male_file = _source_paths(model_dir)
+    with open(female_file) as fo:
+        female_names = [name.strip() for name in fo.readlines()]
+    with open(male_file) as fo:
+        male_names = [name.strip() for name in fo.readlines()]
+
+    term_mapper = {}
+    with open(word_file) as fo:
+        for line in fo:
+            if re.match(' *#', line) or re.match(r' *\n\Z', line):
+                continue
+
+            unidirectional = '=>' in line
+
+            try:
+                terms_0_str, terms_1_str = line.split('=')
+                terms_1_str = terms_1_str.lstrip('>')
+            except ValueError:
+                logging.warning('Invalid line: %s', line)
+                continue
+            terms_0 = [tt.strip().lower() for tt in terms_0_str.split(',')]
+            terms_1 = [tt.strip().lower() for tt in terms_1_str.split(',')]
+
+            for term_0, term_1 in itertools.product(terms_0, terms_1):
+                term_mapper.update({term_0: term_1})
+                if not unidirectional:
+                    term_mapper.update({term_1: term_0})
+
+                # avoid `him = her` becoming `them = their`
+                if _pluralize(term_0) in {'them', 'their'}:
+                    continue
+
+                term_mapper.update(
+                    {_pluralize(term_0): _pluralize(term_1)}
+                )
+                if not unidirectional:
+                    term_mapper.update(
+                        {_pluralize(term_1): _pluralize(term_0)}
+                    )
+
+    return LanguageModel(term_mapper, female_names, male_names, _fingerprint(model_dir))
+
+
+@cached('pluralize')
+def _pluralize(word):
+    from .pluralize import pluralize
+    return pluralize(word)
+
+
+def _source_paths(model_dir):
+    paths = [os.path.join(model_dir, source_file) for source_file in SOURCE_FILES]
+    for path in paths:
+        if not os.path.exists(path):
+            raise MissingLanguageModelError(
+                'Non-existent language model file: "{}"'.format(path)
+            )
+    return paths
+
+
+def _fingerprint(model_dir):
+    hasher = hashlib.sha1(str(COMPILED_FORMAT_VERSION).encode())
+    for path in _source_paths(model_dir):
+        with open(path, 'rb') as fo:
+            hasher.update(fo.read())
+    return hasher.hexdigest()
+
+
+def _compiled_paths(model_dir):
+    """The compiled model is kept next to its source files, or in the user's
+    cache folder if the package isn't writable.
+    """
+    cache_dir = os.path.join(
+        os.environ.get('XDG_CACHE_HOME', os.path.expanduser(os.path.join('~', '.cache'))),
+        'gender_bender',
+    )
+    model_id = hashlib.sha1(os.path.abspath(model_dir).encode()).hexdigest()
+    return [
+        os.path.join(model_dir, COMPILED_FILE),
+        os.path.join(cache_dir, '{}.{}'.format(model_id, COMPILED_FILE)),
+    ]
+
+
+def _read_compiled(compiled_path):
+    try:
+        with open(compiled_path, 'rb') as fo:
+            return LanguageModel(**pickle.load(fo))
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, TypeError, pickle.UnpicklingError) as error:
+        logging.warning('Ignoring unreadable compiled language model %s: %s',
+                        compiled_path, error)
+        return None
+
+
+def _write_compiled(model, model_dir):
+    for compiled_path in _compiled_paths(model_dir):
+        try:
+            os.makedirs(os.path.dirname(compiled_path), exist_ok=True)
+            # Written to a temporary file first so that concurrent processes
+            # never read a partly written model
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(compiled_path))
+            with os.fdopen(fd, 'wb') as fo:
+                pickle.dump(model.to_dict(), fo, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, compiled_path)
+            return compiled_path
+        except OSError as error:
+            logging.debug('Could not write compiled language model %s: %s',
+                          compiled_path, error)
+    return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compile language models')
+    parser.add_argument('language_models', nargs='*', default=['english'],
+                        help='Names of bundled language models or paths of '
+                             'language model folders')
+    args = parser.parse_args()
+
+    for name in args.language_models:
+        model_dir = get_model_dir(name)
+        compiled_path = _write_compiled(compile_language_model(model_dir), model_dir)
+        print('{} -> {}'.format(model_dir, compiled_path))
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Extraction of the text of (X)HTML documents.
+
+The document is split with a regex lexer into markup (tags, comments,
+declarations, and the content of `<script>`/`<style>` elements) and text
+nodes.  The text nodes are joined into a single text, the text of inline
+elements (`<em>`, `<a>`, ...) running on with the surrounding text, and other
+tags ending a block.  Replacements found in that text are then spliced back
+into the text nodes, leaving the markup untouched.
+"""
+import bisect
+import re
+
+# Text runs on across these, any other tag ends a block of text
+INLINE_TAGS = {
+    'a', 'abbr', 'acronym', 'b', 'bdi', 'bdo', 'big', 'cite', 'code', 'del', 'dfn',
+    'em', 'font', 'i', 'ins', 'kbd', 'mark', 'q', 's', 'samp', 'small', 'span',
+    'strike', 'strong', 'sub', 'sup', 'time', 'tt', 'u', 'var',
+}
+# Put between the text of two blocks
+BLOCK_SEPARATOR = '\n\n'
+
+_MARKUP_REGEX = re.compile(
+    r'<!--.*?-->'
+    r'|<!\[CDATA\[.*?\]\]>'
+    r'|<(script|style)\b(?:[^>"\']|"[^"]*"|\'[^\']*\')*>.*?</\1\s*>'
+    r'|<[!?][^>]*>'
+    r'|</?([a-zA-Z][\w:.-]*)(?:[^>"\']|"[^"]*"|\'[^\']*\')*>',
+    re.DOTALL | re.IGNORECASE,
+)
+
+
+class MarkupDocument:
+    def __init__(self, document):
+        """
+        :param str document: (X)HTML document
+        """
+        self.document = document
+        # Parallel lists describing the text nodes: where they start in
+        # `document`, and where they start and end in `text`
+        self._document_starts = []
+        self._text_starts = []
+        self._text_ends = []
+
+        chunks = []
+        length = 0
+        last_end = 0
+        ends_block = False
+        for markup_match in _MARKUP_REGEX.finditer(document):
+            if markup_match.start() > last_end:
+                if ends_block and chunks:
+                    chunks.append(BLOCK_SEPARATOR)
+                    length += len(BLOCK_SEPARATOR)
+                length = self._add_node(chunks, length, last_end, markup_match.start())
+                ends_block = False
+            tag = markup_match.group(2)
+            ends_block = ends_block or tag is None or tag.lower() not in INLINE_TAGS
+            last_end = markup_match.end()
+        if last_end < len(document):
+            if ends_block and chunks:
+                chunks.append(BLOCK_SEPARATOR)
+                length += len(BLOCK_SEPARATOR)
+            self._add_node(chunks, length, last_end, len(document))
+
+        #: the text nodes of the document, blocks separated by `BLOCK_SEPARATOR`
+        self.text = ''.join(chunks)
+
+    def _add_node(self, chunks, length, start, end):
+        chunks.append(self.document[start:end])
+        self._document_starts.append(start)
+        self._text_starts.append(length)
+        self._text_ends.append(length + end - start)
+        return length + end - start
+
+    def splice(self, replacements):
+        """Applies replacements of spans of `text` to the document.
+
+        A span covering several text nodes (e.g. `<b>h</b>er`) is replaced in
+        the first of them, and removed from the others.
+
+        :param replacements: iterable of `(start, end, replacement)` tuples,
+            in order of appearance in `text`
+        :return: the new document
+        """
+        segments = []
+        last_end = 0
+        for start, end, replacement in replacements:
+            first = self._node_index(start)
+            last = self._node_index(end - 1)
+            segments.append(self.document[last_end:self._to_document(first, start)])
+            segments.append(replacement)
+            for ii in range(first + 1, last + 1):
+                # Keeps the markup between the nodes
+                segments.append(self.document[
+                    self._to_document(ii - 1, self._text_ends[ii - 1]):
+                    self._document_starts[ii]
+                ])
+            last_end = self._to_document(last, min(end, self._text_ends[last]))
+        segments.append(self.document[last_end:])
+        return ''.join(segments)
+
+    def _node_index(self, pos):
+        return bisect.bisect_right(self._text_starts, pos) - 1
+
+    def _to_document(self, node_index, pos):
+        return self._document_starts[node_index] + pos - self._text_starts[node_index]
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Precomputed table of the name each known name flips to.
+
+Without interactive naming, a name flips to the name suggested for it, which
+only depends on the name, gender_guesser's dataset and the lists of names of
+the language model.  So the suggestion for every name of the dataset and of
+the lists is computed ahead of time, and shipped with the language model as a
+gzipped TSV file.  Flipping a name is then a dict lookup, and gender_guesser
+(slow to load) isn't needed at all.
+
+The table records what it was computed from, and is ignored (falling back on
+computing the names on the fly) if that changed.  To rebuild it:
+
+    python -m gender_bender.name_table english
+"""
+import argparse
+import functools
+import hashlib
+import importlib.util
+import logging
+import os
+import re
+
+from .compact_table import load_compact_table
+from .language_model import compile_language_model, get_model_dir
+from .names import NameIndex, known_names, name_gender, suggest_name
+
+NAME_TABLE_FILE = 'name_table.tsv.gz'
+# Bump this whenever the way names are suggested changes
+NAME_TABLE_FORMAT_VERSION = 1
+# Names that can't be a word of a text are never looked up
+_NAME_REGEX = re.compile("[a-z']+")
+
+
+def build_name_table(model_dir):
+    """
+    :return: dict of lower case name to the lower case name it flips to, for
+        every name whose gender is known
+    """
+    model = compile_language_model(model_dir)
+    female_names = NameIndex(model.female_names)
+    male_names = NameIndex(model.male_names)
+    names = {name.lower() for name in known_names()}
+    names.update(model.female_names, model.male_names)
+
+    name_table = {}
+    for name in sorted(names):
+        if not _NAME_REGEX.fullmatch(name):
+            continue
+        gender = name_gender(name, female_names, male_names)
+        new_name = suggest_name(name, gender, female_names, male_names)
+        if new_name is not None:
+            name_table[name] = new_name
+    return name_table
+
+
+def write_name_table(name_table, model_dir, language_model_fingerprint):
+    import gzip
+
+    path = os.path.join(model_dir, NAME_TABLE_FILE)
+    # `mtime=0` so that the file only changes when the table does
+    with open(path, 'wb') as raw_fo, \
+            gzip.GzipFile(fileobj=raw_fo, mode='wb', mtime=0) as gzip_fo:
+        lines = ['# {}\n'.format(name_table_fingerprint(language_model_fingerprint))]
+        lines.extend('{}\t{}\n'.format(name, new_name)
+                     for name, new_name in sorted(name_table.items()))
+        gzip_fo.write(''.join(lines).encode('utf-8'))
+    return path
+
+
+def load_name_table(model_dir, language_model_fingerprint, compact=False):
+    """
+    :param bool compact: whether the table is loaded as a memory-mapped
+        `CompactTable` rather than a dict
+    :return: the name table of the language model, or `None` if it has none
+        or it's out of date
+    """
+    fingerprint = name_table_fingerprint(language_model_fingerprint)
+    if compact:
+        return load_compact_table('name_table', fingerprint,
+                                  lambda: _read_name_table(model_dir, fingerprint))
+    return _read_name_table(model_dir, fingerprint)
+
+
+def _read_name_table(model_dir, fingerprint):
+    import gzip
+
+    path = os.path.join(model_dir, NAME_TABLE_FILE)
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as fo:
+            header = fo.readline()
+            if header.strip() != '# {}'.format(fingerprint):
+                logging.warning('Ignoring out of date name table %s (rebuild it with '
+                                '`python -m gender_bender.name_table`)', path)
+                return None
+            return dict(line.rstrip('\n').split('\t') for line in fo)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as error:
+        logging.warning('Ignoring unreadable name table %s: %s', path, error)
+        return None
+
+
+@functools.lru_cache()
+def name_table_fingerprint(language_model_fingerprint):
+    """
+    :return: hash of everything the name table of a language model is
+        computed from (recorded in the header of the table)
+    """
+    hasher = hashlib.sha1('{} {}'.format(NAME_TABLE_FORMAT_VERSION,
+                                         language_model_fingerprint).encode())
+    # gender_guesser's dataset, found without importing gender_guesser
+    package_dirs = importlib.util.find_spec('gender_guesser').submodule_search_locations
+    with open(os.path.join(list(package_dirs)[0], 'data', 'nam_dict.txt'), 'rb') as fo:
+        hasher.update(fo.read())
+    return hasher.hexdigest()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the name tables of language models')
+    parser.add_argument('language_models', nargs='*', default=['english'],
+                        help='Names of bundled language models or paths of '
+                             'language model folders')
+    args = parser.parse_args()
+
+    for name in args.language_models:
+        model_dir = get_model_dir(name)
+        table = build_name_table(model_dir)
+        path = write_name_table(table, model_dir,
+                                compile_language_model(model_dir).fingerprint)
+        print('{} -> {} ({} names)'.format(model_dir, path, len(table)))
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import tempfile
+import threading
+
+from .caches import cached
+
+# gender_guesser's detector holds a large dictionary of names, so it's loaded
+# once and shared
+_gender_detector = None
+_gender_detector_lock = threading.Lock()
+
+
+@cached('gender')
+def guess_gender(name):
+    """
+    :param str name: title case name
+    :return: one of `female`, `mostly_female`, `male`, `mostly_male`, `andy`
+        (androgynous) or `unknown`
+    """
+    return _get_gender_detector().get_gender(name)
+
+
+def known_names():
+    """The names whose gender `guess_gender()` knows."""
+    return _get_gender_detector().names.keys()
+
+
+def _get_gender_detector():
+    global _gender_detector
+    with _gender_detector_lock:
+        if _gender_detector is None:
+            import gender_guesser.detector as gender_detector
+            _gender_detector = gender_detector.Detector()
+    return _gender_detector
+
+
+def name_gender(name, female_names, male_names):
+    """Guesses the gender of a name, falling back on the lists of names of the
+    language model for names gender_guesser doesn't know.
+
+    :param str name: lower case name
+    :param NameIndex female_names:
+    :param NameIndex male_names:
+    :return: one of `female`, `male`, `andy` (androgynous) or `unknown`
+    """
+    gender = guess_gender(titlecase(name))
+    # `mostly_female`/`mostly_male` are just treated as `female`/`male`
+    if gender.startswith('mostly_'):
+        gender = gender[len('mostly_'):]
+    if gender == 'unknown':
+        is_female = name in female_names
+        is_male = name in male_names
+        if is_female and is_male:
+            gender = 'andy'
+        elif is_female or is_male:
+            gender = 'female' if is_female else 'male'
+    return gender
+
+
+def suggest_name(name, gender, female_names, male_names):
+    """Chooses a name of the opposite gender, with the largest common prefix.
+
+    :param str name: lower case name
+    :param str gender: gender of `name`, see `name_gender()`
+    :return: lower case name (`name` itself if it's androgynous), or `None` if
+        the gender is unknown
+    """
+    if gender == 'andy':
+        return name
+    if gender == 'unknown':
+        return None
+    names = male_names if gender == 'female' else female_names
+    return names.suggest(name)
+
+
+@cached('titlecase')
+def titlecase(text):
+    from titlecase import titlecase
+    return titlecase(text)
+
+
+class NamingSession:
+    """The names chosen while flipping a document (or related documents, such
+    as the chapters of a book), so that each name is always flipped the same
+    way.
+    """
+    def __init__(self, name_mapper=None, not_names=None, autosave_path=None):
+        """
+        :param dict name_mapper: lower case name to the lower case name it
+            flips to
+        :param set not_names: lower case words that were rejected as names
+        :param str autosave_path: file the session is saved to whenever a
+            name is chosen interactively, so that no answer is lost if the
+            process dies
+        """
+        self.name_mapper = dict(name_mapper or {})
+        self.not_names = set(not_names or ())
+        self.autosave_path = autosave_path
+
+    @classmethod
+    def load(cls, path, autosave_path=None):
+        """Loads a session saved with `save()`."""
+        with open(path) as fo:
+            state = json.load(fo)
+        return cls(state['name_mapper'], state['not_names'], autosave_path)
+
+    def save(self, path):
+        state = {'name_mapper': self.name_mapper, 'not_names': sorted(self.not_names)}
+        # Written to a temporary file first, so that a crash never leaves a
+        # partly written session
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        with os.fdopen(fd, 'w') as fo:
+            json.dump(state, fo, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def autosave(self):
+        if self.autosave_path is not None:
+            self.save(self.autosave_path)
+
+
+class NameIndex:
+    """Set of names that can also suggest the name with the longest common
+    prefix with a given name.
+
+    Membership is a hash lookup and suggestions walk a character trie, so both
+    take time proportional to the length of the name rather than to the number
+    of names.
+    """
+    def __init__(self, names):
+        """
+        :param list names: lower case names, in order of preference
+        """
+        self._names = set(names)
+        # Each trie node is a `[first_name, children]` pair, where `first_name`
+        # is the first of `names` starting with the node's prefix
+        self._trie = [None, {}]
+        for name in names:
+            node = self._trie
+            for char in name:
+                node = node[1].setdefault(char, [name, {}])
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __len__(self):
+        return len(self._names)
+
+    def suggest(self, name):
+        """Finds the first name sharing the longest prefix with `name`.
+
+        Like the original list scan, the common prefix is at most one character
+        shorter than `name`.
+
+        :param str name: lower case name
+        :return: the suggested name, or `None` if no name starts with the same
+            letter as `name`
+        """
+        node = self._trie
+        for char in name[:-1]:
+            child = node[1].get(char)
+            if child is None:
+                break
+            node = child
+        return node[0]
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Loading of the spaCy pipeline.
+
+Flipping only reads the POS tags and the entity types of the tokens, so by
+default the components of the model that produce anything else (the
+dependency parser, the lemmatizer) aren't loaded.  A pipeline profile chooses
+which components are left out.
+
+The spaCy model is never downloaded unless asked to, since it's a network call
+that fails in offline environments.  To install it ahead of time:
+
+    python -m spacy download en_core_web_sm
+"""
+import logging
+
+DEFAULT_SPACY_MODEL = 'en_core_web_sm'
+# Components of the spaCy model left out by each profile:
+#  - `default`: everything but the tagger (and, in spaCy 3, the attribute
+#    ruler mapping its tags to POS tags) and the entity recognizer
+#  - `tagger`: the entity recognizer too, so names are only found in the name
+#    lists
+#  - `full`: nothing
+PIPELINE_PROFILES = {
+    'default': ('parser', 'lemmatizer'),
+    'tagger': ('parser', 'lemmatizer', 'ner'),
+    'full': (),
+}
+DEFAULT_PROFILE = 'default'
+
+
+class MissingSpacyModelError(Exception):
+    pass
+
+
+def check_profile(profile):
+    if profile not in PIPELINE_PROFILES:
+        raise ValueError('Unknown pipeline profile: "{}" (choose from: {})'.format(
+            profile, ', '.join(PIPELINE_PROFILES)))
+
+
+def load_pipeline(spacy_model=DEFAULT_SPACY_MODEL, profile=DEFAULT_PROFILE, download=False):
+    """
+    :param str spacy_model: name of an installed spaCy model, or path of one
+    :param str profile: one of `PIPELINE_PROFILES`
+    :param bool download: whether the model gets downloaded if it isn't
+        installed, rather than raising `MissingSpacyModelError`
+    """
+    import spacy
+
+    check_profile(profile)
+    try:
+        return _load(spacy, spacy_model, PIPELINE_PROFILES[profile])
+    except OSError as error:
+        if not download:
+            raise MissingSpacyModelError(
+                'Could not load the spaCy model "{}" ({}).  Install it with: '
+                'python -m spacy download {}'.format(spacy_model, error, spacy_model)
+            ) from error
+
+    logging.info('Downloading the spaCy model %s (don\'t worry, this will only happen '
+                 'once)', spacy_model)
+    from spacy.cli import download as download_model
+    download_model(spacy_model)
+    return _load(spacy, spacy_model, PIPELINE_PROFILES[profile])
+
+
+def _load(spacy, spacy_model, excluded_components):
+    if int(spacy.__version__.split('.')[0]) >= 3:
+        # The components aren't even loaded, which saves memory and load time
+        return spacy.load(spacy_model, exclude=excluded_components)
+    return spacy.load(spacy_model, disable=excluded_components)
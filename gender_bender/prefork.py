@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Pre-fork mode, where many worker processes share a single copy of the
+models.
+
+The parent process loads everything the flippers only ever read (the spaCy
+model, the language model, the name lists) once, then forks its workers:
+
+    from gender_bender import prefork
+    prefork.preload(engines=('word',))
+    pids = prefork.fork_workers(8, serve_requests)
+
+A forked worker shares the memory pages of its parent until either of them
+writes to a page.  Python writes to the header of every object it touches (to
+count its references, and when the garbage collector goes through it), so to
+keep the pages shared:
+
+ - the term mapper and the name table are memory-mapped `CompactTable`s
+   rather than dicts of strings (see `compact_table`), which the workers only
+   read
+ - the objects loaded up front are moved out of reach of the garbage
+   collector with `gc.freeze()`
+
+After `preload()`, the worker pools of `gender_bend_epub()`,
+`gender_bend_books()` and `AsyncGenderBender` fork their workers too
+(whatever the default start method of the platform), so they share the
+models loaded up front.
+"""
+import gc
+import logging
+import multiprocessing
+import os
+
+from . import gender_tools
+
+
+def preload(engines=('word',), compact_tables=True):
+    """Loads the models of the engines in this process, for the processes it
+    forks afterwards to share.
+
+    :param engines: engines the workers flip with (see `gender_bend()`)
+    :param bool compact_tables: whether the term mapper and the name table are
+        memory-mapped, so that their pages stay shared however many lookups
+        the workers make, at the cost of slower lookups
+    """
+    with gender_tools._flippers_lock:
+        if compact_tables != gender_tools._compact_tables:
+            gender_tools._compact_tables = compact_tables
+            gender_tools._flippers.clear()
+    with gender_tools._shared_resources_lock:
+        # The language models loaded the other way would be frozen for nothing
+        for key in list(gender_tools._shared_resources):
+            if key[0] == 'language_model' and key[2] != compact_tables:
+                del gender_tools._shared_resources[key]
+    gender_tools._mp_context = multiprocessing.get_context('fork')
+    for engine in engines:
+        # Flipping a text also fills the lazily built parts of the models
+        gender_tools._get_flipper(engine).flip_gender('She gave him her book.')
+    gc.collect()
+    # The objects loaded so far are never collected, so the garbage collector
+    # doesn't write to them (and copy their pages) in the workers
+    gc.freeze()
+
+
+def fork_workers(num_workers, target):
+    """Forks worker processes, each one calling `target(index)` then exiting.
+
+    :return: list of the process IDs of the workers (for `os.waitpid()`)
+    """
+    pids = []
+    for index in range(num_workers):
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                target(index)
+            except BaseException:
+                logging.exception('Worker %s failed', index)
+                exit_code = 1
+            finally:
+                # Leaves without running the clean-up of the parent process
+                os._exit(exit_code)
+        pids.append(pid)
+    return pids
+
+
+def memory_usage(pid=None):
+    """
+    :param int pid: process ID (by default, the current process)
+    :return: dict of the resident (`rss`), proportional (`pss`, shared pages
+        being split between the processes sharing them) and unique (`uss`,
+        pages no other process shares) memory of the process in bytes, or
+        `None` where `/proc/<pid>/smaps_rollup` isn't available (outside of
+        Linux)
+    """
+    path = '/proc/{}/smaps_rollup'.format(pid or 'self')
+    try:
+        with open(path) as fo:
+            lines = fo.readlines()
+    except OSError:
+        return None
+    fields = {}
+    for line in lines:
+        parts = line.split()
+        if len(parts) == 3 and parts[2] == 'kB':
+            fields[parts[0].rstrip(':')] = 1024 * int(parts[1])
+    return {
+        'rss': fields['Rss'],
+        'pss': fields['Pss'],
+        'uss': fields['Private_Clean'] + fields['Private_Dirty'],
+    }
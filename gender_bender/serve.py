@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""Local HTTP server keeping a warm `GenderBender`, so that the services
+flipping texts share one process (and one copy of the models):
+
+    python -m gender_bender.serve --port 8000 --max-batch-size 32 --max-wait-ms 5
+
+Endpoints:
+
+ - `POST /text`: flips the text in the body (UTF-8)
+ - `POST /epub`: flips the epub in the body (`?text_only=1` to only flip the
+   text of its documents, see `gender_bend_epub()`)
+ - `GET /metrics`: throughput and latency of each endpoint, and size of the
+   batches, as JSON
+ - `GET /health`
+
+Texts sent concurrently are gathered into micro-batches, parsed by spaCy in a
+single pass (see `GenderBender.flip_gender_many()`).  A batch is flipped as
+soon as it holds `max_batch_size` texts, or `max_wait` seconds after its first
+text came in.  Each text gets its own naming session.
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from .gender_tools import _get_flipper, configure_pipeline, gender_bend_epub
+from .pipeline import DEFAULT_PROFILE, DEFAULT_SPACY_MODEL, PIPELINE_PROFILES
+
+# The `word` engine isn't offered, since a batch is parsed as a whole anyway
+SERVER_ENGINES = ('document', 'fast')
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT = 0.005
+MAX_BODY_SIZE = 256 * 1024 * 1024
+# Number of the most recent latencies of each endpoint the percentiles are
+# computed on
+LATENCY_WINDOW = 10000
+
+
+class MicroBatcher:
+    """Gathers the texts submitted from any thread into batches, flipped one
+    after the other in a thread of their own.
+    """
+    def __init__(self, flipper, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_wait=DEFAULT_MAX_WAIT, metrics=None):
+        """
+        :param GenderBender flipper:
+        :param int max_batch_size: maximum number of texts per batch
+        :param float max_wait: seconds a text waits for more texts to join its
+            batch
+        :param ServerMetrics metrics: gets the size of each batch
+        """
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._flipper = flipper
+        self._metrics = metrics
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='gender-bender-batcher',
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, text):
+        """
+        :return: `Future` of the flipped text
+        :raises RuntimeError: once the batcher is closed
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Cannot submit texts to a closed batcher')
+            self._queue.put((text, future))
+        return future
+
+    def flip(self, text):
+        return self.submit(text).result()
+
+    def close(self):
+        """Flips the texts already submitted, then stops the thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+        # Whatever the thread left behind (if it stopped on an error) would
+        # never be flipped
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[1].set_exception(RuntimeError('The batcher was closed'))
+
+    def _run(self):
+        closing = False
+        while not closing:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    closing = True
+                    break
+                batch.append(item)
+            self._flip_batch(batch)
+
+    def _flip_batch(self, batch):
+        if self._metrics is not None:
+            self._metrics.record_batch(len(batch))
+        texts = [text for text, _ in batch]
+        try:
+            flipped_texts = list(self._flipper.flip_gender_many(texts,
+                                                                batch_size=len(texts)))
+        except Exception:
+            # So that a text that can't be flipped only fails its own request
+            logging.exception('Could not flip a batch of %s texts, flipping them one by one',
+                              len(texts))
+            for text, future in batch:
+                try:
+                    future.set_result(self._flipper.flip_gender(text))
+                except Exception as error:
+                    future.set_exception(error)
+            return
+        for (_, future), flipped_text in zip(batch, flipped_texts):
+            future.set_result(flipped_text)
+
+
+class ServerMetrics:
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._requests = collections.Counter()
+        self._errors = collections.Counter()
+        self._bytes = collections.Counter()
+        self._latencies = collections.defaultdict(
+            lambda: collections.deque(maxlen=LATENCY_WINDOW))
+        self._batches = 0
+        self._batched_texts = 0
+
+    def record_request(self, endpoint, seconds, num_bytes, error=False):
+        with self._lock:
+            self._requests[endpoint] += 1
+            self._bytes[endpoint] += num_bytes
+            self._latencies[endpoint].append(seconds)
+            if error:
+                self._errors[endpoint] += 1
+
+    def record_batch(self, size):
+        with self._lock:
+            self._batches += 1
+            self._batched_texts += size
+
+    def snapshot(self):
+        """
+        :return: dict of the metrics of each endpoint (throughput since the
+            server started, latency percentiles of the most recent requests)
+            and of the batches
+        """
+        with self._lock:
+            uptime = time.time() - self.started
+            endpoints = {}
+            for endpoint, count in self._requests.items():
+                latencies = sorted(self._latencies[endpoint])
+                endpoints[endpoint] = {
+                    'requests': count,
+                    'errors': self._errors[endpoint],
+                    'requests_per_s': count / uptime,
+                    'bytes_per_s': self._bytes[endpoint] / uptime,
+                    'latency_ms': {
+                        name: 1000 * percentile(latencies, fraction)
+                        for name, fraction in [('p50', 0.5), ('p90', 0.9), ('p99', 0.99),
+                                               ('max', 1)]
+                    },
+                }
+            return {
+                'uptime_s': uptime,
+                'endpoints': endpoints,
+                'batches': self._batches,
+                'mean_batch_size': (self._batched_texts / self._batches
+                                    if self._batches else None),
+            }
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+class GenderBenderServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Many clients connect at once, beyond the default backlog of 5
+    request_queue_size = 1024
+
+    def __init__(self, address, engine='document', max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_wait=DEFAULT_MAX_WAIT):
+        """
+        :param address: `(host, port)` to listen on (port 0 picks a free one)
+        :param str engine: one of `SERVER_ENGINES`
+        """
+        if engine not in SERVER_ENGINES:
+            raise ValueError('Unknown engine: "{}" (choose from: {})'.format(
+                engine, ', '.join(SERVER_ENGINES)))
+        self.engine = engine
+        self.metrics = ServerMetrics()
+        # Loads the models before the first request comes in
+        self.batcher = MicroBatcher(_get_flipper(engine), max_batch_size, max_wait,
+                                    self.metrics)
+        super().__init__(address, _RequestHandler)
+
+    def flip_epub(self, content, text_only=False):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, 'book.epub')
+            output_path = os.path.join(tmp_dir, 'book_gender_bent.epub')
+            with open(input_path, 'wb') as fo:
+                fo.write(content)
+            gender_bend_epub(input_path, output_path, engine=self.engine,
+                             text_only=text_only)
+            with open(output_path, 'rb') as fo:
+                return fo.read()
+
+    def server_close(self):
+        super().server_close()
+        self.batcher.close()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    # Keeps connections alive between requests
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are written separately, which Nagle's algorithm
+    # would delay until the client acknowledges the headers
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/metrics':
+            self._send(200, json.dumps(self.server.metrics.snapshot(), indent=2).encode(),
+                       'application/json')
+        elif path == '/health':
+            self._send(200, b'ok\n', 'text/plain')
+        else:
+            self._send(404, b'Not found\n', 'text/plain')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if not 0 <= length <= MAX_BODY_SIZE:
+            # The body can't be read, so neither can the next request
+            self.close_connection = True
+            if length > MAX_BODY_SIZE:
+                self._send(413, b'Body too large\n', 'text/plain')
+            else:
+                self._send(400, b'Invalid Content-Length\n', 'text/plain')
+            return
+        body = self.rfile.read(length)
+        if url.path not in ('/text', '/epub'):
+            self._send(404, b'Not found\n', 'text/plain')
+            return
+
+        start = time.perf_counter()
+        status = 200
+        try:
+            if url.path == '/text':
+                response = self.server.batcher.flip(body.decode('utf-8')).encode('utf-8')
+                content_type = 'text/plain; charset=utf-8'
+            else:
+                text_only = parse_qs(url.query).get('text_only', ['0'])[0] in {'1', 'true'}
+                response = self.server.flip_epub(body, text_only)
+                content_type = 'application/epub+zip'
+        except UnicodeDecodeError:
+            status, response, content_type = 400, b'The text must be UTF-8\n', 'text/plain'
+        except Exception as error:
+            logging.exception('Could not flip the body of %s', url.path)
+            status, content_type = 500, 'text/plain'
+            response = '{}: {}\n'.format(type(error).__name__, error).encode('utf-8')
+        self.server.metrics.record_request(url.path, time.perf_counter() - start, length,
+                                           error=status != 200)
+        self._send(status, response, content_type)
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug('%s - %s', self.address_string(), format % args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serves gender flipping over HTTP')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='Port to listen on (0 picks a free one)')
+    parser.add_argument('-e', '--engine', choices=SERVER_ENGINES, default='document')
+    parser.add_argument('--max-batch-size', type=int, default=DEFAULT_MAX_BATCH_SIZE,
+                        help='Maximum number of texts parsed in a single pass')
+    parser.add_argument('--max-wait-ms', type=float, default=1000 * DEFAULT_MAX_WAIT,
+                        help='Milliseconds a text waits for other texts to join its batch')
+    parser.add_argument('--spacy-model', type=str, default=DEFAULT_SPACY_MODEL,
+                        help='Name or path of the spaCy model')
+    parser.add_argument('--pipeline-profile', choices=PIPELINE_PROFILES,
+                        default=DEFAULT_PROFILE,
+                        help='Components of the spaCy model to load')
+    parser.add_argument('--download-model', action='store_true',
+                        help='Download the spaCy model if it isn\'t installed')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    configure_pipeline(args.spacy_model, args.pipeline_profile, args.download_model)
+    server = GenderBenderServer((args.host, args.port), args.engine, args.max_batch_size,
+                                args.max_wait_ms / 1000)
+    host, port = server.server_address[:2]
+    # Printed on stdout, for the scripts starting the server
+    print('Serving on http://{}:{}'.format(host, port), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Counters and timings of the work done while flipping texts.
+
+Collecting them is opt-in (see `GenderBender.enable_stats()`): while disabled,
+the flipping code only checks that no stats are being collected once per
+text.
+"""
+import collections
+import threading
+import time
+
+COUNTERS = (
+    'texts', 'chars', 'words', 'terms_replaced', 'names_replaced', 'names_detected',
+    'nlp_calls', 'disk_cache_hits', 'disk_cache_misses',
+)
+# Cumulative seconds spent:
+#  - `nlp`: running the spaCy pipeline
+#  - `gender`: guessing the gender of names
+#  - `suggest`: choosing the names they flip to
+#  - `rebuild`: assembling the flipped texts
+#  - `total`: flipping, all stages included
+STAGES = ('nlp', 'gender', 'suggest', 'rebuild', 'total')
+
+
+class FlipStats:
+    def __init__(self, callback=None):
+        """
+        :param callback: function called with the `FlipStats` of each text
+            after it's flipped, e.g. to export them to a metrics system
+        """
+        self.counts = collections.Counter(dict.fromkeys(COUNTERS, 0))
+        self.seconds = collections.Counter(dict.fromkeys(STAGES, 0))
+        self.callback = callback
+        self._lock = threading.Lock()
+
+    def add(self, other):
+        """Adds the counts and timings of `other` (e.g. those of a text) to
+        these, then calls the callback with `other`.
+        """
+        with self._lock:
+            self.counts.update(other.counts)
+            self.seconds.update(other.seconds)
+        if self.callback is not None:
+            self.callback(other)
+
+    def increment(self, counter, value=1):
+        """Adds to a counter, without calling the callback."""
+        with self._lock:
+            self.counts[counter] += value
+
+    def snapshot(self):
+        """
+        :return: dict with the `counts` and `seconds` (per stage) so far
+        """
+        with self._lock:
+            return {'counts': dict(self.counts), 'seconds': dict(self.seconds)}
+
+    def reset(self):
+        with self._lock:
+            self.counts = collections.Counter(dict.fromkeys(COUNTERS, 0))
+            self.seconds = collections.Counter(dict.fromkeys(STAGES, 0))
+
+    def __repr__(self):
+        return 'FlipStats({})'.format(self.snapshot())
+
+
+def timed(stats, stage, function, *args):
+    """Calls `function`, adding the time it takes to `stage` of `stats` (if
+    not `None`).
+    """
+    if stats is None:
+        return function(*args)
+    start = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        stats.seconds[stage] += time.perf_counter() - start
+
+
+class TimedNlp:
+    """Wraps a spaCy pipeline, counting its calls and the time they take."""
+    def __init__(self, nlp, stats):
+        self._nlp = nlp
+        self._stats = stats
+
+    def __call__(self, text):
+        self._stats.counts['nlp_calls'] += 1
+        return timed(self._stats, 'nlp', self._nlp, text)
+
+    def pipe(self, texts, **kwargs):
+        docs = self._nlp.pipe(texts, **kwargs)
+        while True:
+            self._stats.counts['nlp_calls'] += 1
+            try:
+                doc = timed(self._stats, 'nlp', next, docs)
+            except StopIteration:
+                self._stats.counts['nlp_calls'] -= 1
+                return
+            yield doc
+
+    def __getattr__(self, name):
+        return getattr(self._nlp, name)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import re
+
+# A run of whitespace holding at most one line break
+_SPACE_PATTERN = r'(?:[^\S\n]+(?:\n[^\S\n]*)?|\n[^\S\n]*)'
+
+
+class TermMatcher:
+    """Matches terms made of several words (e.g. `matron of honor` or
+    `jack-of-all-trades`) in a text.
+
+    The terms are compiled into a single case-insensitive regex whose
+    alternatives are factored into a character trie, so a match attempt costs
+    about the length of the matched text, whatever the number of terms.
+    """
+    def __init__(self, terms):
+        """
+        :param terms: lower case terms, where a space stands for any run of
+            whitespace within a paragraph (a blank line, e.g. the
+            `BLOCK_SEPARATOR` between two blocks of markup, ends the term)
+        """
+        trie = {}
+        for term in terms:
+            node = trie
+            for char in term:
+                node = node.setdefault(char, {})
+            node[''] = {}
+        if trie:
+            # The match must not end in the middle of a word
+            self._regex = re.compile('(?:{})(?![a-zA-Z])'.format(_trie_pattern(trie)),
+                                     re.IGNORECASE)
+        else:
+            self._regex = None
+
+    def match(self, text, pos):
+        """Finds the longest term starting at `pos` in `text`.
+
+        :return: end of the term in `text`, or `None` if no term starts at
+            `pos`
+        """
+        if self._regex is None:
+            return None
+        match = self._regex.match(text, pos)
+        return match.end() if match else None
+
+
+def normalize_term(text):
+    """The form under which a matched term is in the term mapper."""
+    return ' '.join(text.lower().split())
+
+
+def _trie_pattern(node):
+    is_end = '' in node
+    alternatives = []
+    # Sorted so that the generated regex is deterministic
+    for char, child in sorted(node.items()):
+        if char == '':
+            continue
+        char_pattern = _SPACE_PATTERN if char == ' ' else re.escape(char)
+        alternatives.append(char_pattern + _trie_pattern(child))
+
+    if not alternatives:
+        return ''
+    if len(alternatives) == 1 and not is_end:
+        return alternatives[0]
+    # Greedy, so the longest term is tried first
+    return '(?:{}){}'.format('|'.join(alternatives), '?' if is_end else '')
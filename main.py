@@ -1,20 +1,97 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import argparse
+import glob
+import logging
+import os
+import sys
 
-from gender_bender import gender_bend_epub
+from gender_bender import (NamingSession, choose_names, configure_pipeline, enable_disk_cache,
+                           gender_bend_books, gender_bend_epub, prescan_names)
+from gender_bender.gender_tools import ENGINES
+from gender_bender.pipeline import DEFAULT_PROFILE, DEFAULT_SPACY_MODEL, PIPELINE_PROFILES
+from gender_bender.prefork import preload
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('-i', '--input', type=str, required=True,
-                        help='Path of epub to gender bend')
+    parser.add_argument('-i', '--input', type=str, nargs='+', required=True,
+                        help='Path of epub to gender bend, or several epubs, folders '
+                             'and glob patterns to flip all their books')
     parser.add_argument('-o', '--output', type=str, required=False,
-                        help='Path of epub to gender bend')
+                        help='Path of the gender bent epub, or folder of the gender '
+                             'bent books when flipping several')
+    parser.add_argument('-m', '--manifest', type=str,
+                        help='When flipping several books, file recording the outcome '
+                             'of each book, so that an interrupted run resumes where it '
+                             'stopped (by default, in the output folder)')
     parser.add_argument('-n', '--interactive-naming', action='store_true',
                         help='Get prompted for each name (recommended for '
                              'accurately translating ebooks)')
+    parser.add_argument('-e', '--engine', choices=ENGINES, default='word',
+                        help='Whether spaCy is run on each word separately, '
+                             'once on each whole document (much faster), or not '
+                             'at all (fastest, but misses more names)')
+    parser.add_argument('--spacy-model', type=str, default=DEFAULT_SPACY_MODEL,
+                        help='Name or path of the spaCy model')
+    parser.add_argument('--pipeline-profile', choices=PIPELINE_PROFILES,
+                        default=DEFAULT_PROFILE,
+                        help='Components of the spaCy model to load (`tagger` only '
+                             'finds names from the name lists)')
+    parser.add_argument('--download-model', action='store_true',
+                        help='Download the spaCy model if it isn\'t installed')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes to spread the book (or the books) '
+                             'across')
+    parser.add_argument('--prefork', action='store_true',
+                        help='Load the models before starting the processes, so that they '
+                             'share a single copy of them (Linux only)')
+    parser.add_argument('-t', '--text-only', action='store_true',
+                        help='Only flip the text of the book, leaving its markup '
+                             '(tags, attributes, ...) untouched')
+    parser.add_argument('-c', '--cache', action='store_true',
+                        help='Cache the flipped documents on disk, so that flipping '
+                             'them again is much faster')
+    parser.add_argument('--names-in', type=str,
+                        help='Session file (see --names-out) with the names chosen '
+                             'before, e.g. for a previous volume')
+    parser.add_argument('--names-out', type=str,
+                        help='File the chosen names are saved to (after each answer '
+                             'with interactive naming)')
+    parser.add_argument('-p', '--prescan', action='store_true',
+                        help='Find all the names of the book first, and get prompted for '
+                             'them up front')
 
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    configure_pipeline(args.spacy_model, args.pipeline_profile, args.download_model)
+    if args.cache:
+        enable_disk_cache()
+    if args.prefork:
+        preload(engines=(args.engine,))
 
-    gender_bend_epub(args.input, args.output, args.interactive_naming)
+    if len(args.input) > 1 or os.path.isdir(args.input[0]) or glob.has_magic(args.input[0]):
+        if args.interactive_naming or args.names_in or args.names_out or args.prescan:
+            parser.error('The naming options only work with a single book')
+        counts = gender_bend_books(args.input, args.output, args.manifest, args.jobs,
+                                   args.engine, args.text_only)
+        print('Flipped {done} books, skipped {skipped} already flipped, {failed} '
+              'failed'.format(**counts))
+        sys.exit(1 if counts['failed'] else 0)
+
+    args.input, = args.input
+    if not os.path.isfile(args.input):
+        parser.error('No such file: {}'.format(args.input))
+
+    if args.names_in:
+        session = NamingSession.load(args.names_in, autosave_path=args.names_out)
+    else:
+        session = NamingSession(autosave_path=args.names_out)
+    if args.prescan:
+        choose_names(prescan_names(args.input, args.engine, args.text_only, session),
+                     session)
+
+    gender_bend_epub(args.input, args.output, args.interactive_naming, args.engine,
+                     args.jobs, session, args.text_only)
+    if args.names_out:
+        session.save(args.names_out)
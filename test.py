@@ -1,9 +1,48 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import http.client
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
+import unittest.mock
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from unittest import skip
 
-from gender_bender import gender_bend
-from gender_bender.gender_tools import _copy_case
+from gender_bender import (AsyncGenderBender, GenderBender, NamingSession, choose_names,
+                           disable_disk_cache, disk_cache_info, enable_disk_cache, gender_bend,
+                           gender_bend_async, gender_bend_epub, gender_bend_incremental,
+                           gender_bend_many, gender_bend_markup, prescan_names)
+from gender_bender.batch import MANIFEST_FILE, Manifest, find_books, gender_bend_books
+from gender_bender.caches import CachedFunction, cache_info, configure_caches
+from gender_bender.compact_table import CompactTable, load_compact_table, write_compact_table
+from gender_bender.disk_cache import DiskCache
+from gender_bender.epub import iter_documents, rewrite_epub
+from gender_bender.gender_tools import _FastAnalyzer, _WordAnalyzer, _copy_case
+from gender_bender.language_model import (COMPILED_FILE, LANGUAGE_MODELS_DIR,
+                                          MissingLanguageModelError, get_model_dir,
+                                          load_language_model)
+from gender_bender.markup import BLOCK_SEPARATOR, MarkupDocument
+from gender_bender.name_table import (build_name_table, load_name_table,
+                                      write_name_table)
+from gender_bender.names import NameIndex, name_gender
+from gender_bender.pipeline import PIPELINE_PROFILES, MissingSpacyModelError, load_pipeline
+from gender_bender.serve import GenderBenderServer, MicroBatcher, ServerMetrics
+from gender_bender.stats import FlipStats
+from gender_bender.term_matcher import TermMatcher
+
+
+def _temp_dir(test_case):
+    """Creates a temporary folder, removed once the test is done."""
+    temp_dir = tempfile.TemporaryDirectory()
+    test_case.addCleanup(temp_dir.cleanup)
+    return temp_dir.name
+
 
 class TestFlipGender(unittest.TestCase):
 
@@ -46,6 +85,13 @@ class TestFlipGender(unittest.TestCase):
         self.assertEqual(result, 'he was one of many first year students in '
                                  'the class')
 
+    def test_multi_word_term(self):
+        text = 'The Meter  Maid\'s car and the PREHISTORIC MAN'
+
+        result = gender_bend(text)
+        self.assertEqual(result, 'The Parking enforcement officer\'s car and the '
+                                 'PREHISTORIC PERSON')
+
     def test_flip_word_with_apostrophe(self):
         text = 'the Queen\'s got a picture of this island'
 
@@ -183,6 +229,1029 @@ class TestFlipGender(unittest.TestCase):
         self.assertEqual(result, 'Mr. Copperfield')
 
 
+class TestFlipGenderDocumentEngine(unittest.TestCase):
+
+    def test_flip_back_and_forth(self):
+        text = 'himself did not know herself.'
+
+        result = gender_bend(text, engine='document')
+        self.assertEqual(result, 'herself did not know himself.')
+
+    def test_flip_word_with_apostrophe(self):
+        text = 'the Queen\'s got a picture of this island'
+
+        result = gender_bend(text, engine='document')
+        self.assertEqual(result, 'the King\'s got a picture of this island')
+
+    def test_contraction(self):
+        text = 'She\'ll be there'
+
+        result = gender_bend(text, engine='document')
+        self.assertEqual(result, 'He\'ll be there')
+
+    def test_third_person_singular_declensions_1(self):
+        text = 'By her own hand was her sword crafted for her'
+
+        result = gender_bend(text, engine='document')
+        self.assertEqual(result, 'By his own hand was his sword crafted for him')
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            gender_bend('she', engine='telepathy')
+
+
+class TestFlipGenderFastEngine(unittest.TestCase):
+
+    def test_simple_sentence(self):
+        text = 'If Ivanka weren\'t my daughter, perhaps I\'d be dating her.'
+
+        result = gender_bend(text, engine='fast')
+        self.assertEqual(result, 'If Ivan weren\'t my son, perhaps I\'d be dating him.')
+
+    def test_flip_word_with_apostrophe(self):
+        text = 'the Queen\'s got a picture of this island'
+
+        result = gender_bend(text, engine='fast')
+        self.assertEqual(result, 'the King\'s got a picture of this island')
+
+    def test_contraction(self):
+        text = 'She\'ll be there'
+
+        result = gender_bend(text, engine='fast')
+        self.assertEqual(result, 'He\'ll be there')
+
+    def test_third_person_singular_declensions(self):
+        text = 'By her own hand was her sword crafted for her, and the book is his.'
+
+        result = gender_bend(text, engine='fast')
+        self.assertEqual(result,
+                         'By his own hand was his sword crafted for him, and the book is hers.')
+
+    def test_object_followed_by_adposition(self):
+        text = 'He picked her up quickly and left'
+
+        result = gender_bend(text, engine='fast')
+        self.assertEqual(result, 'She picked him up quickly and left')
+
+    def test_names_from_lists(self):
+        result = gender_bend('Simon met Ralph', engine='fast')
+        self.assertEqual(result, 'Simone met Rachael')
+
+    def test_spacy_is_not_loaded(self):
+        code = ('import sys, gender_bender; gender_bender.gender_bend("she", engine="fast"); '
+                'print("spacy" in sys.modules)')
+
+        result = subprocess.check_output([sys.executable, '-c', code],
+                                         universal_newlines=True)
+        self.assertEqual(result.strip(), 'False')
+
+
+class TestGenderBender(unittest.TestCase):
+
+    def test_session_collects_names(self):
+        session = NamingSession()
+
+        result = GenderBender().flip_gender('Simon met Ralph', session=session)
+        self.assertEqual(result, 'Simone met Rachael')
+        self.assertEqual(session.name_mapper, {'simon': 'simone', 'ralph': 'rachael'})
+
+    def test_session_names_are_reused(self):
+        session = NamingSession({'simon': 'sarah'})
+
+        result = gender_bend('Simon met Ralph', session=session)
+        self.assertEqual(result, 'Sarah met Rachael')
+
+    def test_sessions_do_not_leak(self):
+        gender_bend('Simon met Ralph', session=NamingSession({'simon': 'sarah'}))
+
+        result = gender_bend('Simon met Ralph')
+        self.assertEqual(result, 'Simone met Rachael')
+
+    def test_concurrent_calls(self):
+        texts = ['Simon, walking in front of Ralph, felt a flicker of incredulity',
+                 'If Ivanka weren\'t my daughter, perhaps I\'d be dating her.'] * 8
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(gender_bend, texts))
+        self.assertEqual(results, [gender_bend(text) for text in texts])
+
+
+class TestGenderBendIncremental(unittest.TestCase):
+
+    def test_only_changed_lines_are_flipped(self):
+        old_text = 'Simon went to see Nancy.\nThe boy was there.'
+        new_text = 'Simon went to see Nancy.\nThe king was there.\nHe left.'
+        old_flipped_text = 'Bob went to see Nancy.\nThe girl was there.'
+
+        result = gender_bend_incremental(old_text, old_flipped_text, new_text)
+        self.assertEqual(result, 'Bob went to see Nancy.\nThe queen was there.\nShe left.')
+
+    def test_same_as_full_run(self):
+        old_text = 'It was made by her\nvery quickly and\nthen she left.'
+        new_text = 'It was made by her\nown dog\nthen she left.'
+
+        result = gender_bend_incremental(old_text, gender_bend(old_text), new_text)
+        self.assertEqual(result, gender_bend(new_text))
+
+    def test_session_names_are_kept(self):
+        session = NamingSession({'simon': 'jane'})
+        old_text = 'Simon is here.'
+        old_flipped_text = gender_bend(old_text, session=session)
+
+        result = gender_bend_incremental(old_text, old_flipped_text,
+                                         'Simon is here.\nSimon left.', session=session)
+        self.assertEqual(result, 'Jane is here.\nJane left.')
+
+
+class TestFlipStats(unittest.TestCase):
+
+    def test_stats(self):
+        flipper = GenderBender()
+        texts_stats = []
+        stats = flipper.enable_stats(callback=texts_stats.append)
+
+        flipper.flip_gender('Simon told her about the actress.')
+        self.assertEqual(
+            {counter: stats.counts[counter] for counter in
+             ['texts', 'words', 'terms_replaced', 'names_detected', 'names_replaced']},
+            {'texts': 1, 'words': 6, 'terms_replaced': 2, 'names_detected': 1,
+             'names_replaced': 1},
+        )
+        self.assertGreater(stats.counts['nlp_calls'], 0)
+        self.assertGreaterEqual(stats.seconds['total'], stats.seconds['nlp'])
+        self.assertEqual(len(texts_stats), 1)
+
+    def test_disabled_by_default(self):
+        flipper = GenderBender()
+
+        flipper.flip_gender('Simon told her about the actress.')
+        self.assertIsNone(flipper.stats)
+
+    def test_add(self):
+        stats = FlipStats()
+        text_stats = FlipStats()
+        text_stats.counts['words'] = 3
+        text_stats.seconds['nlp'] = 0.5
+
+        stats.add(text_stats)
+        stats.add(text_stats)
+        self.assertEqual(stats.snapshot()['counts']['words'], 6)
+        self.assertEqual(stats.snapshot()['seconds']['nlp'], 1)
+
+
+class TestGenderBendMany(unittest.TestCase):
+
+    def test_keeps_order(self):
+        texts = ['himself did not know herself.', 'A column of spray wetted them.',
+                 'She\'ll be there']
+
+        result = list(gender_bend_many(iter(texts), batch_size=2))
+        self.assertEqual(result, ['herself did not know himself.',
+                                  'A column of spray wetted them.',
+                                  'He\'ll be there'])
+
+    def test_is_lazy(self):
+        def texts():
+            yield 'she'
+            raise AssertionError('Consumed more texts than needed')
+
+        result = gender_bend_many(texts(), batch_size=1)
+        self.assertEqual(next(result), 'he')
+
+
+class TestAsync(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_gender_bend_async(self):
+        texts = ['himself did not know herself.', 'the boy glanced over his shoulder']
+
+        async def flip_all():
+            return await asyncio.gather(*[gender_bend_async(text) for text in texts])
+
+        results = self.loop.run_until_complete(flip_all())
+        self.assertEqual(results, ['herself did not know himself.',
+                                   'the girl glanced over her shoulder'])
+
+    def test_cancelled_call_never_runs(self):
+        flipper = AsyncGenderBender(max_workers=1, max_pending=1)
+        release = threading.Event()
+        calls = []
+
+        async def scenario():
+            blocking = asyncio.ensure_future(flipper._run(release.wait))
+            waiting = asyncio.ensure_future(flipper._run(calls.append, 'ran'))
+            await asyncio.sleep(0.05)
+            waiting.cancel()
+            release.set()
+            await blocking
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+            # The slot of the cancelled call was given back
+            await flipper._run(calls.append, 'after')
+
+        self.loop.run_until_complete(scenario())
+        flipper.shutdown()
+        self.assertEqual(calls, ['after'])
+
+
+class TestGenderBendMarkup(unittest.TestCase):
+
+    def test_markup_is_untouched(self):
+        text = '<p id="Henry" title="his">She told <em>the boy</em>.</p>'
+
+        result = gender_bend_markup(text)
+        self.assertEqual(result, '<p id="Henry" title="his">He told <em>the girl</em>.</p>')
+
+    def test_phrase_across_inline_tags(self):
+        text = '<p>She was the matron <i>of</i> honor.</p>'
+
+        result = gender_bend_markup(text)
+        self.assertEqual(result, '<p>He was the honored attendant<i></i>.</p>')
+
+    def test_no_phrase_across_blocks(self):
+        text = '<p>I met the meter</p><p>maid today. She said</p>'
+
+        result = gender_bend_markup(text, engine='fast')
+        self.assertEqual(result, '<p>I met the meter</p><p>house cleaner today. He said</p>')
+
+
+class TestMarkupDocument(unittest.TestCase):
+
+    def test_text(self):
+        document = ('<?xml version="1.0"?><html><head><title>Book</title>'
+                    '<style>p > em { color: red; }</style></head><body>'
+                    '<p class="a>b">One <b>two</b> three</p><!-- four --><p>five</p>'
+                    '<script>if (a < b) {}</script></body></html>')
+
+        result = MarkupDocument(document).text
+        self.assertEqual(result, BLOCK_SEPARATOR.join(['Book', 'One two three', 'five']))
+
+    def test_splice(self):
+        document = '<p>a <b>h</b>er b</p><p>c</p>'
+        markup_document = MarkupDocument(document)
+        self.assertEqual(markup_document.text, 'a her b' + BLOCK_SEPARATOR + 'c')
+
+        result = markup_document.splice([(2, 5, 'his'), (9, 10, 'd')])
+        self.assertEqual(result, '<p>a <b>his</b> b</p><p>d</p>')
+
+    def test_splice_nothing(self):
+        document = '<html>\n<body>\n<p>text &amp; <br/>more</p>\n</body>\n</html>\n'
+
+        result = MarkupDocument(document).splice([])
+        self.assertEqual(result, document)
+
+
+def _write_test_epub(path):
+    with zipfile.ZipFile(path, 'w') as zout:
+        zout.writestr('mimetype', 'application/epub+zip', zipfile.ZIP_STORED)
+        zout.writestr('META-INF/container.xml', (
+            '<?xml version="1.0"?>'
+            '<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+            '<rootfiles><rootfile full-path="OEBPS/content.opf"/></rootfiles>'
+            '</container>'
+        ), zipfile.ZIP_DEFLATED)
+        zout.writestr('OEBPS/content.opf', (
+            '<?xml version="1.0"?>'
+            '<package xmlns="http://www.idpf.org/2007/opf"><manifest>'
+            '<item href="chapter%201.xhtml" media-type="application/xhtml+xml"/>'
+            '<item href="style.css" media-type="text/css"/>'
+            '<item href="cover.png" media-type="image/png"/>'
+            '</manifest></package>'
+        ), zipfile.ZIP_DEFLATED)
+        zout.writestr('OEBPS/chapter 1.xhtml', '<p>She told the boy.</p>',
+                      zipfile.ZIP_DEFLATED)
+        zout.writestr('OEBPS/style.css', 'p { text-align: center; }', zipfile.ZIP_DEFLATED)
+        zout.writestr('OEBPS/cover.png', b'\x89PNG\xff\xfe her', zipfile.ZIP_STORED)
+
+
+class TestEpub(unittest.TestCase):
+
+    def setUp(self):
+        self.input_path = os.path.join(_temp_dir(self), 'book.epub')
+        self.output_path = os.path.join(_temp_dir(self), 'book.epub')
+        _write_test_epub(self.input_path)
+
+    def test_iter_documents(self):
+        result = list(iter_documents(self.input_path))
+        self.assertEqual(result, [('OEBPS/chapter 1.xhtml',
+                                   '<p>She told the boy.</p>')])
+
+    def test_only_documents_are_rewritten(self):
+        rewrite_epub(self.input_path, self.output_path,
+                     lambda texts: (text.upper() for text in texts))
+
+        with zipfile.ZipFile(self.input_path) as zin, \
+                zipfile.ZipFile(self.output_path) as zout:
+            self.assertEqual([info.filename for info in zout.infolist()], zin.namelist())
+            for info in zin.infolist():
+                out_info = zout.getinfo(info.filename)
+                self.assertEqual((out_info.compress_type, out_info.date_time),
+                                 (info.compress_type, info.date_time))
+                if info.filename.endswith('.xhtml'):
+                    self.assertEqual(zout.read(info.filename),
+                                     b'<P>SHE TOLD THE BOY.</P>')
+                else:
+                    self.assertEqual(zout.read(info.filename), zin.read(info))
+
+
+class TestGenderBendEpub(unittest.TestCase):
+
+    def test_gender_bend_epub(self):
+        input_path = os.path.join(_temp_dir(self), 'book.epub')
+        output_path = os.path.join(_temp_dir(self), 'book.epub')
+        _write_test_epub(input_path)
+
+        gender_bend_epub(input_path, output_path)
+        with zipfile.ZipFile(output_path) as zout:
+            self.assertEqual(zout.read('OEBPS/chapter 1.xhtml'),
+                             b'<p>He told the girl.</p>')
+
+    def test_text_only(self):
+        input_path = os.path.join(_temp_dir(self), 'book.epub')
+        output_path = os.path.join(_temp_dir(self), 'book.epub')
+        _write_test_epub(input_path)
+
+        gender_bend_epub(input_path, output_path, text_only=True)
+        with zipfile.ZipFile(output_path) as zout:
+            self.assertEqual(zout.read('OEBPS/chapter 1.xhtml'),
+                             b'<p>He told the girl.</p>')
+
+    def test_workers_match_sequential_run(self):
+        input_path = os.path.join(_temp_dir(self), 'book.epub')
+        sequential_path = os.path.join(_temp_dir(self), 'sequential.epub')
+        parallel_path = os.path.join(_temp_dir(self), 'parallel.epub')
+        _write_test_epub(input_path)
+
+        gender_bend_epub(input_path, sequential_path)
+        gender_bend_epub(input_path, parallel_path, workers=2)
+        with open(sequential_path, 'rb') as sequential, open(parallel_path, 'rb') as parallel:
+            self.assertEqual(sequential.read(), parallel.read())
+
+    def test_default_output_path(self):
+        input_path = os.path.join(_temp_dir(self), 'book.epub')
+        _write_test_epub(input_path)
+
+        output_path = gender_bend_epub(input_path, engine='fast')
+        self.assertEqual(output_path, input_path[:-len('.epub')] + '_gender_bent.epub')
+        self.assertTrue(os.path.exists(output_path))
+
+    def test_interactive_naming_with_workers(self):
+        with self.assertRaises(ValueError):
+            gender_bend_epub('examples/olivia_twist.epub', 'out.epub',
+                             interactive_naming=True, workers=2)
+
+
+class TestGenderBendBooks(unittest.TestCase):
+
+    def setUp(self):
+        self.input_dir = _temp_dir(self)
+        self.output_dir = _temp_dir(self)
+        os.mkdir(os.path.join(self.input_dir, 'series'))
+        for name in ['a.epub', 'series/b.epub', 'series/b_gender_bent.epub']:
+            _write_test_epub(os.path.join(self.input_dir, name))
+
+    def _read_chapter(self, name):
+        with zipfile.ZipFile(os.path.join(self.output_dir, name)) as zout:
+            return zout.read('OEBPS/chapter 1.xhtml')
+
+    def test_find_books(self):
+        glob_pattern = os.path.join(self.input_dir, 'series', 'b.*')
+
+        result = find_books([self.input_dir, glob_pattern])
+        self.assertEqual([relative_path for _, relative_path in result],
+                         ['a.epub', os.path.join('series', 'b.epub')])
+
+    def test_glob_leaves_out_flipped_books(self):
+        glob_pattern = os.path.join(self.input_dir, 'series', '*.epub')
+
+        result = find_books([glob_pattern])
+        self.assertEqual([relative_path for _, relative_path in result], ['b.epub'])
+
+    def test_glob_keeps_subfolders(self):
+        glob_pattern = os.path.join(self.input_dir, '**', '*.epub')
+
+        result = find_books([glob_pattern])
+        self.assertEqual([relative_path for _, relative_path in result],
+                         ['a.epub', os.path.join('series', 'b.epub')])
+
+    def test_same_output_path(self):
+        os.mkdir(os.path.join(self.input_dir, 'other'))
+        _write_test_epub(os.path.join(self.input_dir, 'other', 'b.epub'))
+        inputs = [os.path.join(self.input_dir, folder, 'b.epub') for folder in ['series', 'other']]
+
+        with self.assertRaises(ValueError):
+            gender_bend_books(inputs, self.output_dir, engine='fast')
+
+    def test_flips_directory(self):
+        counts = gender_bend_books([self.input_dir], self.output_dir, engine='fast')
+
+        self.assertEqual(counts, {'done': 2, 'skipped': 0, 'failed': 0})
+        self.assertEqual(self._read_chapter('a.epub'), b'<p>He told the girl.</p>')
+        self.assertEqual(self._read_chapter('series/b.epub'), b'<p>He told the girl.</p>')
+        manifest = Manifest(os.path.join(self.output_dir, MANIFEST_FILE))
+        self.assertEqual(sorted(record['status'] for record in manifest.records.values()),
+                         ['done', 'done'])
+
+    def test_resumes(self):
+        gender_bend_books([self.input_dir], self.output_dir, engine='fast')
+        os.remove(os.path.join(self.output_dir, 'a.epub'))
+
+        counts = gender_bend_books([self.input_dir], self.output_dir, engine='fast')
+        self.assertEqual(counts, {'done': 1, 'skipped': 1, 'failed': 0})
+
+    def test_other_output_dir_flips_again(self):
+        manifest_path = os.path.join(self.output_dir, MANIFEST_FILE)
+        gender_bend_books([self.input_dir], self.output_dir, manifest_path, engine='fast')
+        other_output_dir = _temp_dir(self)
+
+        counts = gender_bend_books([self.input_dir], other_output_dir, manifest_path,
+                                   engine='fast')
+        self.assertEqual(counts, {'done': 2, 'skipped': 0, 'failed': 0})
+        self.assertTrue(os.path.exists(os.path.join(other_output_dir, 'a.epub')))
+
+    def test_options_change_flips_again(self):
+        gender_bend_books([self.input_dir], self.output_dir, engine='fast')
+
+        counts = gender_bend_books([self.input_dir], self.output_dir, engine='fast',
+                                   text_only=True)
+        self.assertEqual(counts, {'done': 2, 'skipped': 0, 'failed': 0})
+
+    def test_failed_book_is_recorded(self):
+        with open(os.path.join(self.input_dir, 'broken.epub'), 'w') as fo:
+            fo.write('not a zip')
+
+        counts = gender_bend_books([self.input_dir], self.output_dir, engine='fast')
+        self.assertEqual(counts, {'done': 2, 'skipped': 0, 'failed': 1})
+        counts = gender_bend_books([self.input_dir], self.output_dir, engine='fast')
+        self.assertEqual(counts, {'done': 0, 'skipped': 2, 'failed': 1})
+
+    def test_unmatched_input_fails(self):
+        missing_path = os.path.join(self.input_dir, 'missing.epub')
+
+        counts = gender_bend_books([self.input_dir, missing_path], self.output_dir,
+                                   engine='fast')
+        self.assertEqual(counts, {'done': 2, 'skipped': 0, 'failed': 1})
+
+    def test_workers(self):
+        counts = gender_bend_books([self.input_dir], self.output_dir, workers=2,
+                                   engine='fast')
+
+        self.assertEqual(counts, {'done': 2, 'skipped': 0, 'failed': 0})
+        self.assertEqual(self._read_chapter('series/b.epub'), b'<p>He told the girl.</p>')
+
+
+class TestMicroBatcher(unittest.TestCase):
+
+    def test_gathers_concurrent_texts(self):
+        metrics = ServerMetrics()
+        batcher = MicroBatcher(GenderBender(engine='fast'), max_batch_size=3, max_wait=0.5,
+                               metrics=metrics)
+
+        futures = [batcher.submit(text) for text in ['she', 'her dog', 'he', 'the boy']]
+        results = [future.result() for future in futures]
+        batcher.close()
+        self.assertEqual(results, ['he', 'his dog', 'she', 'the girl'])
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['batches'], 2)
+        self.assertEqual(snapshot['mean_batch_size'], 2)
+
+    def test_closed(self):
+        batcher = MicroBatcher(GenderBender(engine='fast'))
+        future = batcher.submit('she')
+        batcher.close()
+
+        self.assertEqual(future.result(), 'he')
+        with self.assertRaises(RuntimeError):
+            batcher.submit('her dog')
+        batcher.close()
+
+
+class TestServe(unittest.TestCase):
+
+    def setUp(self):
+        self.server = GenderBenderServer(('127.0.0.1', 0), engine='fast')
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.connection = http.client.HTTPConnection(*self.server.server_address[:2])
+
+    def tearDown(self):
+        self.connection.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def _request(self, method, path, body=None):
+        self.connection.request(method, path, body)
+        response = self.connection.getresponse()
+        return response.status, response.read()
+
+    def test_text(self):
+        result = self._request('POST', '/text', 'She told the boy.'.encode('utf-8'))
+        self.assertEqual(result, (200, b'He told the girl.'))
+
+    def test_invalid_text(self):
+        status, _ = self._request('POST', '/text', b'\xff')
+        self.assertEqual(status, 400)
+
+    def test_epub(self):
+        input_path = os.path.join(_temp_dir(self), 'book.epub')
+        output_path = os.path.join(_temp_dir(self), 'book.epub')
+        _write_test_epub(input_path)
+        with open(input_path, 'rb') as fo:
+            status, content = self._request('POST', '/epub?text_only=1', fo.read())
+
+        self.assertEqual(status, 200)
+        with open(output_path, 'wb') as fo:
+            fo.write(content)
+        with zipfile.ZipFile(output_path) as zout:
+            self.assertEqual(zout.read('OEBPS/chapter 1.xhtml'),
+                             b'<p>He told the girl.</p>')
+
+    def test_invalid_content_length(self):
+        for content_length in ['abc', '-1']:
+            connection = http.client.HTTPConnection(*self.server.server_address[:2],
+                                                    timeout=10)
+            connection.putrequest('POST', '/text')
+            connection.putheader('Content-Length', content_length)
+            connection.endheaders()
+
+            response = connection.getresponse()
+            self.assertEqual(response.status, 400)
+            # The connection is closed rather than left waiting for a body
+            self.assertEqual(response.read(), b'Invalid Content-Length\n')
+            self.assertEqual(connection.sock.recv(1) if connection.sock else b'', b'')
+            connection.close()
+
+    def test_metrics(self):
+        self._request('POST', '/text', b'she')
+        self._request('POST', '/text', b'\xff')
+
+        status, content = self._request('GET', '/metrics')
+        self.assertEqual(status, 200)
+        metrics = json.loads(content.decode('utf-8'))
+        self.assertEqual(metrics['endpoints']['/text']['requests'], 2)
+        self.assertEqual(metrics['endpoints']['/text']['errors'], 1)
+        self.assertEqual(metrics['batches'], 1)
+
+    def test_unknown_path(self):
+        status, _ = self._request('GET', '/nothing')
+        self.assertEqual(status, 404)
+
+
+class TestImport(unittest.TestCase):
+
+    def test_heavy_dependencies_are_lazy(self):
+        code = ('import sys, gender_bender; '
+                'print(sorted({"spacy", "gender_guesser", "sqlite3", "mmap", "gzip"} '
+                '& set(sys.modules)))')
+
+        result = subprocess.check_output([sys.executable, '-c', code],
+                                         universal_newlines=True)
+        self.assertEqual(result.strip(), '[]')
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_profile_excludes_components(self):
+        with unittest.mock.patch('spacy.load') as load:
+            load_pipeline('some_model', 'tagger')
+
+        self.assertEqual(load.call_args[0], ('some_model',))
+        self.assertEqual(set(load.call_args[1]['exclude']), set(PIPELINE_PROFILES['tagger']))
+
+    def test_missing_model_is_not_downloaded(self):
+        with unittest.mock.patch('spacy.load', side_effect=OSError('not found')), \
+                unittest.mock.patch('spacy.cli.download') as download:
+            with self.assertRaises(MissingSpacyModelError):
+                load_pipeline('some_model')
+        download.assert_not_called()
+
+    def test_missing_model_is_downloaded_if_asked(self):
+        with unittest.mock.patch('spacy.load', side_effect=[OSError('not found'), 'nlp']), \
+                unittest.mock.patch('spacy.cli.download') as download:
+            self.assertEqual(load_pipeline('some_model', download=True), 'nlp')
+        download.assert_called_once_with('some_model')
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            GenderBender(pipeline_profile='everything')
+
+
+class TestLanguageModel(unittest.TestCase):
+
+    def setUp(self):
+        self.model_dir = _temp_dir(self)
+        self._write('female_names', 'alice\n')
+        self._write('male_names', 'bob\n')
+        self._write('words', '# comment\n\nhe = she\nactress => actor\n')
+
+    def _write(self, file_name, content):
+        with open(os.path.join(self.model_dir, file_name), 'w') as fo:
+            fo.write(content)
+
+    def test_compiles(self):
+        model = load_language_model(self.model_dir)
+
+        self.assertEqual(model.term_mapper, {'he': 'she', 'she': 'he', 'they': 'they',
+                                             'actress': 'actor', 'actresses': 'actors'})
+        self.assertEqual(model.female_names, ['alice'])
+        self.assertEqual(model.male_names, ['bob'])
+        self.assertTrue(os.path.exists(os.path.join(self.model_dir, COMPILED_FILE)))
+
+    def test_recompiles_when_source_changes(self):
+        load_language_model(self.model_dir)
+        self._write('words', 'king = queen\n')
+
+        model = load_language_model(self.model_dir)
+        self.assertEqual(model.term_mapper['king'], 'queen')
+        self.assertNotIn('he', model.term_mapper)
+
+    def test_missing_file(self):
+        os.remove(os.path.join(self.model_dir, 'male_names'))
+
+        with self.assertRaises(MissingLanguageModelError):
+            load_language_model(self.model_dir)
+
+    def test_bundled_name_before_folder(self):
+        os.mkdir(os.path.join(self.model_dir, 'english'))
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.model_dir)
+
+        self.assertEqual(get_model_dir('english'), os.path.join(LANGUAGE_MODELS_DIR, 'english'))
+        self.assertEqual(get_model_dir(os.path.join('.', 'english')),
+                         os.path.join('.', 'english'))
+
+
+class TestNamingSession(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(_temp_dir(self), 'names.json')
+
+    def test_save_load(self):
+        NamingSession({'simon': 'jane'}, {'rose'}).save(self.path)
+
+        result = NamingSession.load(self.path)
+        self.assertEqual((result.name_mapper, result.not_names),
+                         ({'simon': 'jane'}, {'rose'}))
+
+    def test_autosave_after_each_answer(self):
+        session = NamingSession(autosave_path=self.path)
+        answers = []
+
+        def get_new_name(name, context, suggested_name):
+            answers.append(NamingSession.load(self.path).name_mapper
+                           if os.path.exists(self.path) else None)
+            return 'Jane'
+
+        gender_bend('Simon met Ralph.', interactive_naming=get_new_name, session=session)
+        self.assertEqual(answers, [None, {'simon': 'jane'}])
+        self.assertEqual(NamingSession.load(self.path).name_mapper,
+                         {'simon': 'jane', 'ralph': 'jane'})
+
+    def test_prescan(self):
+        input_path = os.path.join(_temp_dir(self), 'book.epub')
+        with zipfile.ZipFile(input_path, 'w') as zout:
+            zout.writestr('chapter.xhtml', '<p>Simon met Ralph.  Simon left.</p>')
+        session = NamingSession({'ralph': 'rachael'})
+
+        names = prescan_names(input_path, session=session)
+        self.assertEqual([name for name, _, _ in names], ['Simon'])
+        self.assertEqual(session.name_mapper, {'ralph': 'rachael'})
+
+        with unittest.mock.patch('builtins.input', return_value='Jane'):
+            choose_names(names, session)
+        self.assertEqual(session.name_mapper, {'ralph': 'rachael', 'simon': 'jane'})
+
+    def test_choose_names_without_suggestion(self):
+        session = NamingSession()
+
+        with unittest.mock.patch('builtins.input', side_effect=['s', 'Jane']) as input_, \
+                unittest.mock.patch('builtins.print'):
+            choose_names([('Zorblax', 'Zorblax left.', None)], session)
+        self.assertEqual(input_.call_count, 2)
+        self.assertEqual(session.name_mapper, {'zorblax': 'jane'})
+
+
+class TestNameTable(unittest.TestCase):
+
+    def setUp(self):
+        self.model_dir = _temp_dir(self)
+        for file_name, content in [('female_names', 'alice\nlatoya\n'),
+                                   ('male_names', 'bob\nalbert\nlamont\n'),
+                                   ('words', 'he = she\n')]:
+            with open(os.path.join(self.model_dir, file_name), 'w') as fo:
+                fo.write(content)
+
+    def test_build(self):
+        name_table = build_name_table(self.model_dir)
+
+        self.assertEqual(name_table['alice'], 'albert')
+        # Unknown to gender_guesser, but in the lists of names
+        self.assertEqual(name_table['latoya'], 'lamont')
+        self.assertEqual(name_table['lamont'], 'latoya')
+
+    def test_write_load(self):
+        write_name_table({'alice': 'albert'}, self.model_dir, 'fingerprint')
+
+        result = load_name_table(self.model_dir, 'fingerprint')
+        self.assertEqual(result, {'alice': 'albert'})
+
+    def test_out_of_date(self):
+        write_name_table({'alice': 'albert'}, self.model_dir, 'fingerprint')
+
+        result = load_name_table(self.model_dir, 'other fingerprint')
+        self.assertIsNone(result)
+
+    def test_bundled_table_is_up_to_date(self):
+        model = load_language_model('english')
+
+        result = load_name_table(get_model_dir('english'), model.fingerprint)
+        self.assertIsNotNone(result)
+
+    def test_name_gender(self):
+        female_names = NameIndex(['latoya'])
+        male_names = NameIndex(['lamont'])
+
+        result = [name_gender(name, female_names, male_names)
+                  for name in ['alice', 'latoya', 'lamont', 'xyzzy']]
+        self.assertEqual(result, ['female', 'female', 'male', 'unknown'])
+
+
+class TestNameIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = NameIndex(['simone', 'rachael', 'rachel', 'sam', 'ivy'])
+
+    def test_contains(self):
+        self.assertIn('rachel', self.index)
+        self.assertNotIn('rach', self.index)
+
+    def test_longest_common_prefix(self):
+        self.assertEqual(self.index.suggest('simon'), 'simone')
+
+    def test_first_name_wins_ties(self):
+        self.assertEqual(self.index.suggest('ralph'), 'rachael')
+
+    def test_prefix_shorter_than_name(self):
+        self.assertEqual(self.index.suggest('ivy'), 'ivy')
+        self.assertEqual(self.index.suggest('iva'), 'ivy')
+
+    def test_no_suggestion(self):
+        self.assertIsNone(self.index.suggest('zack'))
+
+
+class TestCompactTable(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(_temp_dir(self), 'names.table')
+        write_compact_table({'alice': 'albert', 'bob': 'barbara', 'zoë': 'zeke'}, self.path)
+        self.table = CompactTable(self.path)
+
+    def tearDown(self):
+        self.table.close()
+
+    def test_lookups(self):
+        self.assertEqual(self.table['alice'], 'albert')
+        self.assertEqual(self.table.get('zoë'), 'zeke')
+        self.assertIn('bob', self.table)
+        self.assertEqual(len(self.table), 3)
+
+    def test_missing_key(self):
+        self.assertIsNone(self.table.get('carol'))
+        self.assertNotIn('carol', self.table)
+        with self.assertRaises(KeyError):
+            self.table['carol']
+
+    def test_load_writes_table_once(self):
+        load_mapping = unittest.mock.Mock(return_value={'he': 'she'})
+        with unittest.mock.patch.dict(os.environ, {'XDG_CACHE_HOME': _temp_dir(self)}):
+            load_compact_table('words', 'fingerprint', load_mapping).close()
+            table = load_compact_table('words', 'fingerprint', load_mapping)
+
+        self.assertEqual(table['he'], 'she')
+        self.assertEqual(load_mapping.call_count, 1)
+        table.close()
+
+    def test_flipping_is_unchanged(self):
+        text = 'Simon told the waitress that Mr. Jones was her uncle.'
+        with unittest.mock.patch.dict(os.environ, {'XDG_CACHE_HOME': _temp_dir(self)}):
+            compact_flipper = GenderBender(engine='fast', compact_tables=True)
+
+        self.assertIsInstance(compact_flipper._term_mapper, CompactTable)
+        self.assertEqual(compact_flipper.flip_gender(text),
+                         GenderBender(engine='fast').flip_gender(text))
+
+
+@unittest.skipUnless(os.path.exists('/proc/self/smaps_rollup'), 'Needs /proc/<pid>/smaps_rollup')
+class TestPrefork(unittest.TestCase):
+
+    def _worker_memory(self, preload):
+        """
+        :return: unique memory (USS) of a worker forked after it flipped a text
+        """
+        code = '\n'.join([
+            'import os, time',
+            'from gender_bender import gender_bend',
+            'from gender_bender.prefork import fork_workers, memory_usage, preload',
+            'if {}:'.format(preload),
+            '    preload(engines=("fast",))',
+            'ready, done = os.pipe()',
+            'def work(index):',
+            '    gender_bend("She told the boy about Simon. " * 100, engine="fast")',
+            '    os.write(done, b"x")',
+            '    time.sleep(5)',
+            'pids = fork_workers(2, work)',
+            'os.read(ready, 1)',
+            'os.read(ready, 1)',
+            'print(max(memory_usage(pid)["uss"] for pid in pids))',
+            'for pid in pids:',
+            '    os.kill(pid, 9)',
+            '    os.waitpid(pid, 0)',
+        ])
+        env = dict(os.environ, XDG_CACHE_HOME=_temp_dir(self))
+        return int(subprocess.check_output([sys.executable, '-c', code], env=env))
+
+    def test_preload_switches_to_fork(self):
+        code = '\n'.join([
+            'from gender_bender import GenderBender, gender_tools',
+            'from gender_bender.prefork import preload',
+            'GenderBender(engine="fast")',
+            'preload(engines=("fast",))',
+            'print(gender_tools._mp_context.get_start_method())',
+            'print(sorted(key[2] for key in gender_tools._shared_resources',
+            '             if key[0] == "language_model"))',
+        ])
+        env = dict(os.environ, XDG_CACHE_HOME=_temp_dir(self))
+
+        result = subprocess.check_output([sys.executable, '-c', code], env=env,
+                                         universal_newlines=True)
+        # The dicts loaded before are left out
+        self.assertEqual(result.split('\n')[:2], ['fork', '[True]'])
+
+    def test_workers_share_the_models(self):
+        cold_memory = self._worker_memory(preload=False)
+        preloaded_memory = self._worker_memory(preload=True)
+
+        # The workers don't load the models again, nor copy those of the parent
+        self.assertLess(preloaded_memory, cold_memory / 2)
+
+
+class TestCaches(unittest.TestCase):
+
+    def test_hits_and_misses(self):
+        square = CachedFunction(lambda x: x * x, maxsize=2)
+        for x in [1, 2, 1, 3, 2]:
+            square(x)
+
+        info = square.cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 4, 2))
+
+    def test_resize(self):
+        square = CachedFunction(lambda x: x * x, maxsize=2)
+        square(1)
+        square.resize(None)
+
+        info = square.cache_info()
+        self.assertEqual((info.maxsize, info.currsize), (None, 0))
+
+    def test_registered_caches(self):
+        self.assertTrue({'gender', 'titlecase', 'pluralize'} <= set(cache_info()))
+
+    def test_configure_unknown_cache(self):
+        with self.assertRaises(ValueError):
+            configure_caches(spelling=10)
+
+
+class TestDiskCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(_temp_dir(self), 'cache.sqlite3')
+
+    def test_get_set(self):
+        cache = DiskCache(self.path)
+        cache.set('key', {'text': 'he\udcff'})
+
+        result = cache.get('key'), cache.get('other key')
+        self.assertEqual(result, ({'text': 'he\udcff'}, None))
+        self.assertEqual(cache.info()[:3], (1, 1, 1))
+
+    def test_least_recently_used_are_evicted(self):
+        cache = DiskCache(self.path, max_size=25)
+        cache.set('a', 'a' * 8)
+        cache.set('b', 'b' * 8)
+        cache.get('a')
+        cache.set('c', 'c' * 8)
+
+        result = [cache.get(key) for key in 'abc']
+        self.assertEqual(result, ['a' * 8, None, 'c' * 8])
+
+    def test_total_size_is_kept_up_to_date(self):
+        cache = DiskCache(self.path, max_size=25)
+        cache.set('a', 'a' * 8)
+        cache.set('a', 'a' * 4)
+        cache.set('b', 'b' * 8)
+        cache.set('c', 'c' * 8)
+
+        self.assertEqual(cache.info()[2:4], (2, 20))
+        # Reopening the database doesn't count its entries again
+        self.assertEqual(DiskCache(self.path).info()[2:4], (2, 20))
+
+    def test_pickled_cache_shares_the_database(self):
+        cache = DiskCache(self.path)
+        cache.set('key', 'value')
+
+        result = pickle.loads(pickle.dumps(cache)).get('key')
+        self.assertEqual(result, 'value')
+
+
+class TestGenderBendDiskCache(unittest.TestCase):
+
+    def setUp(self):
+        enable_disk_cache(os.path.join(_temp_dir(self), 'cache.sqlite3'))
+
+    def tearDown(self):
+        disable_disk_cache()
+
+    def test_cached_text(self):
+        text = 'Simon told her to go.'
+
+        results = [gender_bend(text) for _ in range(2)]
+        self.assertEqual(results, ['Simone told him to go.'] * 2)
+        self.assertEqual(disk_cache_info()[:3], (1, 1, 1))
+
+    def test_names_of_cached_text_join_session(self):
+        gender_bend('Simon left.')
+        session = NamingSession()
+
+        gender_bend('Simon left.', session=session)
+        self.assertEqual(session.name_mapper, {'simon': 'simone'})
+
+    def test_session_names_win_over_cache(self):
+        gender_bend('Simon left.')
+
+        result = gender_bend('Simon left.', session=NamingSession({'simon': 'jane'}))
+        self.assertEqual(result, 'Jane left.')
+
+    def test_name_table_is_part_of_the_key(self):
+        flipper = GenderBender(engine='fast')
+        key = flipper.cache_key('Simon left.', 'text')
+        flipper._name_table_fingerprint = 'rebuilt table'
+
+        self.assertNotEqual(flipper.cache_key('Simon left.', 'text'), key)
+
+    def test_session_names_unknown_to_name_table(self):
+        text = 'I met Zork today.'
+        # 'zork' isn't in the name table, so only the session maps it
+        with unittest.mock.patch.object(_FastAnalyzer, 'entity_type', return_value='PERSON'):
+            results = [gender_bend(text, engine='fast',
+                                   session=NamingSession({'zork': 'zara'}))
+                       for _ in range(2)]
+            disable_disk_cache()
+            results.append(gender_bend(text, engine='fast',
+                                       session=NamingSession({'zork': 'zara'})))
+
+        self.assertEqual(results, ['I met Zara today.'] * 3)
+
+
+class TestTermMatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.matcher = TermMatcher(['meter maid', 'meter maids', 'jack-of-all-trades'])
+
+    def test_longest_match(self):
+        self.assertEqual(self.matcher.match('two meter maids.', 4), 15)
+
+    def test_case_and_whitespace(self):
+        self.assertEqual(self.matcher.match('Meter\n  MAID', 0), 12)
+
+    def test_punctuation(self):
+        self.assertEqual(self.matcher.match('Jack-of-all-trades', 0), 18)
+
+    def test_no_partial_word(self):
+        self.assertIsNone(self.matcher.match('meter maiden', 0))
+
+    def test_no_blank_line(self):
+        self.assertIsNone(self.matcher.match('meter\n\nmaid', 0))
+
+    def test_no_terms(self):
+        self.assertIsNone(TermMatcher([]).match('meter maid', 0))
+
+
+
+class TestSentenceStarts(unittest.TestCase):
+    def test_sentence_starts(self):
+        text = 'Simon ran.  Then (Ralph) came\n\nin, and 3 Dogs'
+        analyzer = _WordAnalyzer(text, nlp=None)
+        starts = [word for word in ['Simon', 'ran', 'Then', 'Ralph', 'came', 'in', 'Dogs']
+                  if analyzer.is_sentence_start(text.index(word))]
+
+        self.assertEqual(starts, ['Simon', 'Then', 'Dogs'])
+
 
 class TestCopyCase(unittest.TestCase):
     def test_lower_case(self):
@@ -202,3 +1271,9 @@ class TestCopyCase(unittest.TestCase):
         result = _copy_case(example, 'hello')
 
         self.assertEqual(result, 'HELLO')
+
+    def test_all_caps_phrase(self):
+        example = 'BON JOUR'
+        result = _copy_case(example, 'hello there')
+
+        self.assertEqual(result, 'HELLO THERE')